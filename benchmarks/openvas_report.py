@@ -0,0 +1,202 @@
+"""Time reading OpenVas get_reports responses, before and after results were extracted in one pass.
+
+    python benchmarks/openvas_report.py [results ...]
+
+Builds a synthetic get_reports response of each size, about 1.5 KB per result with two thirds of
+them above a cvss of 0, and reads it four ways, best of 3:
+
+    parse_openvas_xml path: the whole response parsed into a tree, then every <result> read
+    get_report stream: the response read as it arrives, one <result> at a time
+
+"before" is the code that was replaced, a find() per field under the pure python ElementTree, and a
+python XMLParser target for the stream. "after" is extract_openvas_result() and
+read_openvas_results() under cElementTree when it is available. Every way must give the same
+vulnerabilities.
+"""
+
+import io
+import sys
+import time
+from collections import OrderedDict
+import xml.etree.ElementTree as PyET
+from perception.classes.xml_output_parser import ET, add_openvas_result, extract_openvas_result, \
+    read_openvas_results
+
+
+def result_text(elem, tag):
+
+    try:
+        return elem.find(tag).text
+    except AttributeError:
+        return None
+
+
+def old_add_openvas_result(host_vulns, result):
+    """The replaced add_openvas_result, which took a <result> element and did a find() per field"""
+
+    host = result_text(result, 'host')
+
+    if host is None:
+        return
+
+    vulns = host_vulns.setdefault(host.strip(), list())
+    nvt = result.find('nvt')
+
+    if nvt is None:
+        return
+
+    cvss = result_text(nvt, 'cvss_base')
+
+    try:
+        if float(cvss) <= 0.0:
+            return
+    except (TypeError, ValueError):
+        return
+
+    vulns.append({'openvas_vuln_oid': nvt.get('oid'),
+                  'openvas_vuln_name': result_text(result, 'name'),
+                  'openvas_vuln_cvss_score': cvss,
+                  'openvas_vuln_cve_id': result_text(nvt, 'cve'),
+                  'openvas_vuln_family': result_text(nvt, 'family'),
+                  'openvas_vuln_bug_id': result_text(nvt, 'bid'),
+                  'openvas_vuln_port': result_text(result, 'port'),
+                  'openvas_vuln_threat_score': result_text(result, 'threat'),
+                  'openvas_vuln_severity_score': result_text(result, 'severity'),
+                  'openvas_vuln_xrefs': result_text(nvt, 'xref'),
+                  'openvas_vuln_tags': result_text(nvt, 'tags')})
+
+
+class OldResultStream(object):
+    """The replaced XMLParser target, it built one <result> at a time with a TreeBuilder"""
+
+    def __init__(self, host_vulns):
+        self.host_vulns = host_vulns
+        self.path = list()
+        self.builder = None
+        self.depth = 0
+
+    def start(self, tag, attrib):
+
+        if self.builder is None and tag == 'result' and self.path and self.path[-1] == 'results':
+            self.builder = PyET.TreeBuilder()
+
+        if self.builder is not None:
+            self.builder.start(tag, attrib)
+            self.depth += 1
+
+        self.path.append(tag)
+
+    def end(self, tag):
+        self.path.pop()
+
+        if self.builder is not None:
+            self.builder.end(tag)
+            self.depth -= 1
+
+            if self.depth == 0:
+                result = self.builder.close()
+                self.builder = None
+                old_add_openvas_result(self.host_vulns, result)
+
+    def data(self, data):
+
+        if self.builder is not None:
+            self.builder.data(data)
+
+    def close(self):
+        pass
+
+
+def report_xml(results):
+
+    def result(i):
+        return ('<result id="r%d"><name>vuln %d</name><owner><name>admin</name></owner><comment/>'
+                '<creation_time>2017</creation_time><host>10.0.%d.%d<asset asset_id="a"/></host><port>%d/tcp</port>'
+                '<nvt oid="1.3.6.1.4.1.25623.1.0.%d"><type>nvt</type><name>n</name><family>fam</family>'
+                '<cvss_base>%s</cvss_base><cve>CVE-2017-%d</cve><bid>NOBID</bid><xref>NOXREF</xref>'
+                '<tags>cvss_base_vector=AV:N|summary=%s</tags><cert/></nvt><scan_nvt_version/><threat>High</threat>'
+                '<severity>5.0</severity><qod><value>80</value><type>remote_banner</type></qod>'
+                '<description>%s</description><original_threat>High</original_threat>'
+                '<original_severity>5.0</original_severity><notes/><overrides/></result>'
+                % (i, i, (i // 250) % 256, i % 250, 80 + i % 1000, i, '5.0' if i % 3 else '0.0', i, 's' * 300,
+                   'd' * 600))
+
+    return ('<get_reports_response status="200"><report id="x"><report id="x"><results start="1">' +
+            ''.join(result(i) for i in range(results)) +
+            '</results></report></report></get_reports_response>').encode('utf8')
+
+
+def tree_before(xml):
+    host_vulns = OrderedDict()
+
+    for results in PyET.fromstring(xml).iter('results'):
+        for result in results.findall('result'):
+            old_add_openvas_result(host_vulns, result)
+
+    return host_vulns
+
+
+def tree_after(xml):
+    host_vulns = OrderedDict()
+
+    for results in ET.fromstring(xml).iter('results'):
+        for result in results.findall('result'):
+            add_openvas_result(host_vulns, extract_openvas_result(result))
+
+    return host_vulns
+
+
+def stream_before(xml):
+    host_vulns = OrderedDict()
+    parser = PyET.XMLParser(target=OldResultStream(host_vulns))
+
+    for i in range(0, len(xml), 65536):
+        parser.feed(xml[i:i + 65536])
+
+    return host_vulns
+
+
+def stream_after(xml):
+    host_vulns = OrderedDict()
+    read_openvas_results(ET.iterparse(io.BytesIO(xml), ('end',)), host_vulns)
+
+    return host_vulns
+
+
+def best_of(f, xml, runs=3):
+
+    best = None
+
+    for run in range(runs):
+        started = time.time()
+        host_vulns = f(xml)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, host_vulns
+
+
+def main(sizes):
+
+    print('results  size    parse_openvas_xml   get_report stream')
+    print('                 before   after      before   after')
+
+    for results in sizes:
+        xml = report_xml(results)
+        times = list()
+        outputs = list()
+
+        for f in (tree_before, tree_after, stream_before, stream_after):
+            elapsed, host_vulns = best_of(f, xml)
+            times.append(elapsed)
+            outputs.append(host_vulns)
+
+        if not all(output == outputs[0] for output in outputs):
+            raise SystemExit('the results differ for %d results' % results)
+
+        print('%-8d %3.0f MB  %6.2f s %6.2f s   %6.2f s %6.2f s'
+              % ((results, len(xml) / 1e6) + tuple(times)))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [20000, 60000])
@@ -2,7 +2,9 @@ from os import makedirs, devnull, path, remove
 from subprocess import Popen, PIPE, call
 from perception.shared.functions import get_product_uuid
 from perception.shared.variables import nmap_tmp_dir
+from perception.config import configuration as config
 from perception.classes.xml_output_parser import parse_nmap_xml, parse_openvas_xml
+from perception.classes.cpe import decode_cpe
 from perception.classes.openvas import create_port_list,\
     create_config,\
     create_target,\
@@ -13,14 +15,28 @@ from perception.classes.openvas import create_port_list,\
     delete_targets,\
     delete_task,\
     start_task,\
-    check_task,\
+    get_task_statuses,\
+    find_port_list,\
+    find_target,\
+    list_port_lists,\
+    list_targets,\
+    create_targets_with_smb_lsc,\
+    create_targets_with_ssh_lsc,\
+    lsc_credentials,\
+    scan_gate,\
     get_report, \
     delete_port_list,\
     delete_config
 from perception.classes.network import Network
+from perception.classes.workers import WorkerPool
+from perception.classes import sql
+from perception.database.models import NmapHost, OpenVasVuln
 import threading
 import syslog
 import time
+import math
+import calendar
+import hashlib
 
 FNULL = open(devnull, 'w')
 
@@ -33,91 +49,421 @@ nmap = p.stdout.read().strip().decode("utf-8")
 system_uuid = get_product_uuid()
 
 
-# TODO: remove duplicate code, follow DRY
-def discover_live_hosts(scan_list):
-    live_host_list = list()
+class ScanJob(object):
+    def __init__(self, subnet, func, args):
+        self.subnet = subnet
+        self.func = func
+        self.args = args
+        self.result = None
+        self.rate_limited = False
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.result
+
+
+class NmapScanQueue(object):
+    def __init__(self, max_processes=4, subnet_rate=10, metrics_interval=60):
+        """Queue nmap runs so at most max_processes run at once, and at most subnet_rate
+        scans are started per subnet (/24 or the scanned cider) per minute"""
+
+        self.max_processes = max_processes
+        self.subnet_rate = subnet_rate
+        self.metrics_interval = metrics_interval
+        self.pool = WorkerPool('NmapScanQueue', max_processes)
+        self.lock = threading.Lock()
+        self.subnet_starts = dict()
+        self.held = dict()
+        self.submitted = 0
+        self.completed = 0
+        self.rate_limited = 0
+        self.last_metrics = time.time()
+
+    @staticmethod
+    def subnet_of(target):
+
+        if '/' in target or ':' in target:
+            return target
+
+        return '%s.0/24' % target.rsplit('.', 1)[0]
+
+    def submit(self, target, func, *args):
+        """Queue func(*args) as a scan of target, returns a ScanJob to wait on"""
+
+        job = ScanJob(self.subnet_of(target), func, args)
+
+        with self.lock:
+            self.submitted += 1
+
+        self.pool.submit(self.run, job)
+        return job
+
+    def subnet_wait(self, subnet):
+        """Seconds until another scan may start on subnet, records the start when it is 0"""
+
+        now = time.time()
+
+        with self.lock:
+            starts = [t for t in self.subnet_starts.get(subnet, []) if t > now - 60]
+
+            if len(starts) >= self.subnet_rate:
+                self.subnet_starts[subnet] = starts
+                return starts[0] + 60 - now
+
+            starts.append(now)
+            self.subnet_starts[subnet] = starts
+            return 0
+
+    def run(self, job):
+
+        wait = self.subnet_wait(job.subnet)
 
-    for x in scan_list:
+        if wait > 0:
+            # free the worker for other subnets, the job is queued again at the subnet's next slot
+            self.hold(job, wait)
+            return
 
-        # find valid hosts and ports
         try:
+            job.result = job.func(*job.args)
 
-            cider = Network.check_if_valid_cider(x)
-            ip_addr = Network.check_if_valid_address(x)
+        finally:
+            with self.lock:
+                self.completed += 1
+            job.done.set()
+            self.log_metrics()
 
-            if ip_addr or cider:
-                addr_type = None
+    def hold(self, job, wait):
+        """Park a rate limited job until wait seconds from now, when its subnet has a free slot"""
 
-                if ip_addr:
-                    addr_type = 'host'
-                if cider:
-                    addr_type = 'cider'
+        with self.lock:
+            if not job.rate_limited:
+                job.rate_limited = True
+                self.rate_limited += 1
 
-                nmap_scan_xml_path = nmap_ssa_scan(x,
-                                                   None,
-                                                   None,
-                                                   None,
-                                                   None,
-                                                   addr_type)
+            if job.subnet in self.held:
+                self.held[job.subnet].append(job)
+                return
 
-                if nmap_scan_xml_path == 99:
-                    syslog.syslog(syslog.LOG_INFO, 'RunNmap error: Could not run on %s %s' % (addr_type, x))
+            self.held[job.subnet] = [job]
+
+        self.release_later(job.subnet, wait)
+
+    def release_later(self, subnet, wait):
+
+        t = threading.Timer(wait, self.release, (subnet,))
+        t.daemon = True
+        t.start()
+
+    def release(self, subnet):
+        """Queue as many held jobs of subnet as it has free slots, and hold the rest until its next one"""
+
+        now = time.time()
+
+        with self.lock:
+            held = self.held[subnet]
+            starts = [t for t in self.subnet_starts.get(subnet, []) if t > now - 60]
+            ready = held[:max(self.subnet_rate - len(starts), 0)]
+            del held[:len(ready)]
+
+            if held:
+                # the slot after the ones the ready jobs will take
+                expires = len(starts) + len(ready) - self.subnet_rate
+                wait = (starts[expires] if expires < len(starts) else now) + 60 - now
+            else:
+                del self.held[subnet]
+
+        for job in ready:
+            self.pool.submit(self.run, job)
+
+        if held:
+            self.release_later(subnet, wait)
+
+    def metrics(self):
+
+        with self.lock:
+            return {'queued': self.pool.queue_depth(),
+                    'held': sum(len(held) for held in self.held.values()),
+                    'running': self.pool.busy(),
+                    'submitted': self.submitted,
+                    'completed': self.completed,
+                    'rate_limited': self.rate_limited}
+
+    def log_metrics(self):
+
+        if time.time() - self.last_metrics < self.metrics_interval:
+            return
+
+        self.last_metrics = time.time()
+        m = self.metrics()
+
+        if m['queued'] or m['held']:
+            syslog.syslog(syslog.LOG_INFO, 'NmapScanQueue info: %d queued, %d held, %d running, %d of %d complete, '
+                                           '%d rate limited' % (m['queued'], m['held'], m['running'], m['completed'],
+                                                                m['submitted'], m['rate_limited']))
+
+
+scan_queue = None
+scan_queue_lock = threading.Lock()
 
-                else:
-                    live_host_list = parse_nmap_xml(nmap_scan_xml_path)
-                    remove(nmap_scan_xml_path[0])
 
-                    return live_host_list
+def get_scan_queue():
+    """The nmap scan queue shared by every scan in this process"""
+
+    global scan_queue
+
+    with scan_queue_lock:
+        if scan_queue is None:
+            scan_queue = NmapScanQueue(getattr(config, 'nmap_max_processes', 4),
+                                       getattr(config, 'nmap_subnet_rate', 10))
+
+    return scan_queue
+
+
+class ScanCache(object):
+    def __init__(self, ttls):
+        """Remember when each ip address was last scanned per scan profile, ttls maps each profile
+        to the seconds a scan stays fresh. nmap_full is the -A host scan, the only nmap profile
+        that stamps nmap_hosts.last_scanned_at, openvas is a full OpenVas scan."""
+
+        self.ttls = ttls
+        self.profiles = {'nmap_full': NmapHost,
+                         'openvas': OpenVasVuln}
+        self.scanned = dict()
+        self.lock = threading.Lock()
+
+    def mark(self, ip_addrs, profile):
+
+        now = time.time()
+
+        with self.lock:
+            for ip_addr in ip_addrs:
+                self.scanned[(ip_addr, profile)] = now
+
+    def load(self, ip_addrs, profile):
+        """Fill the cache from last_scanned_at for addresses it has not seen"""
+
+        missing = [i for i in ip_addrs if (i, profile) not in self.scanned]
+
+        if not missing:
+            return
+
+        model = self.profiles[profile]
+        cache_db_session = sql.Sql.create_session()
+
+        try:
+            rows = cache_db_session.query(model.ip_addr, model.last_scanned_at)\
+                .filter(model.ip_addr.in_(missing))\
+                .filter(model.last_scanned_at != None).all()
+
+            with self.lock:
+                for row in rows:
+                    self.scanned[(str(row.ip_addr), profile)] = calendar.timegm(row.last_scanned_at.utctimetuple())
+
+        except Exception as cache_e:
+            syslog.syslog(syslog.LOG_INFO, 'ScanCache error: %s' % str(cache_e))
+
+        cache_db_session.close()
+
+    def not_fresh(self, ip_addrs, profile, force=False):
+        """Return the addresses that need a scan, all of them when force is set"""
+
+        if force:
+            return list(ip_addrs)
+
+        self.load(ip_addrs, profile)
+        stale_after = time.time() - self.ttls[profile]
+
+        with self.lock:
+            need_scan = [i for i in ip_addrs if self.scanned.get((i, profile), 0) < stale_after]
+
+        if len(need_scan) < len(ip_addrs):
+            syslog.syslog(syslog.LOG_INFO, 'ScanCache info: skipping %d recently scanned hosts for %s'
+                          % (len(ip_addrs) - len(need_scan), profile))
+
+        return need_scan
+
+
+scan_cache = ScanCache({'nmap_full': getattr(config, 'nmap_cache_ttl', 60*60),
+                        'openvas': getattr(config, 'openvas_cache_ttl', 24*(60*60))})
+
+
+def discover_live_hosts(scan_list):
+    """Sweep the targets and return the live hosts nmap identified a product on, the only ones
+    an OpenVas scan can be set up for, or 99"""
+
+    live_host_list = list()
+
+    def keep_live_host(record):
+        if any(port.cpe is not None for port in record.ports):
+            live_host_list.append(record)
+
+    # find valid hosts and ciders
+    targets, invalid = Network.validate_targets(scan_list)
+
+    if invalid:
+        syslog.syslog(syslog.LOG_INFO, 'RunNmap info: skipping %d invalid targets: %s'
+                      % (len(invalid), ', '.join(str(x) for x in invalid[:10])))
+
+    for x, addr_type in targets.items():
+
+        try:
+            make_nmap_tmp_dir()
+
+            host_count = get_scan_queue().submit(x,
+                                                 nmap_ssa_scan,
+                                                 x,
+                                                 None,
+                                                 None,
+                                                 None,
+                                                 None,
+                                                 addr_type,
+                                                 keep_live_host).wait()
+
+            if host_count == 99 or host_count is None:
+                syslog.syslog(syslog.LOG_INFO, 'RunNmap error: Could not run on %s %s' % (addr_type, x))
 
         except TypeError as type_e:
             syslog.syslog(syslog.LOG_INFO, 'RunOpenVas error: %s' % str(type_e))
             return 99
 
-        if not live_host_list:
-            syslog.syslog(syslog.LOG_INFO, 'RunOpenVas info: Host list is empty')
-            return 99
+    if not live_host_list:
+        syslog.syslog(syslog.LOG_INFO, 'RunOpenVas info: Host list is empty')
+        return 99
+
+    return live_host_list
+
+
+def make_nmap_tmp_dir():
+
+    try:
+        makedirs(nmap_tmp_dir)
+    except OSError as os_e:
+        if os_e.errno == 17 and path.isdir(nmap_tmp_dir):
+            pass
+        else:
+            syslog.syslog(syslog.LOG_INFO, str(os_e))
+
+
+def run_nmap(args, scan_name, nmap_info=(None, None, None, None), host_info=None, full_scan=True, on_host=None):
+    """Run nmap and parse its xml output. With nmap_stream set the xml is read from nmap's stdout
+    while the scan runs, otherwise it is written to a file in nmap_tmp_dir and parsed when nmap exits.
+    Only a full_scan stamps last_scanned_at, on_host is called with each live host.
+    Returns the number of live hosts or 99."""
+
+    if getattr(config, 'nmap_stream', False):
+        nmap_process = Popen([nmap] + args + ['-oX', '-'],
+                             shell=False,
+                             stdout=PIPE,
+                             stderr=FNULL)
+
+        host_count = parse_nmap_xml((nmap_process.stdout,) + tuple(nmap_info), host_info, full_scan, on_host)
+        nmap_process.stdout.close()
+
+        if nmap_process.wait() != 0:
+            syslog.syslog(syslog.LOG_INFO, 'Nmap exited with %d scanning %s' % (nmap_process.returncode, scan_name))
 
+        return host_count
 
-# TODO: remove duplicate code, follow DRY
-def nmap_ssa_scan(host, mac, mac_vendor, adjacency_switch, adjacency_int, addr_type):
-    port_scan = 1
-    xml_file = False
+    xml_file = '%s%s.xml.%d' % (nmap_tmp_dir, scan_name, int(time.time()))
+
+    port_scan = call([nmap] + args + ['-oX', xml_file],
+                     shell=False,
+                     stdout=FNULL)
+
+    if port_scan != 0:
+        return 99
+
+    host_count = parse_nmap_xml((xml_file,) + tuple(nmap_info), host_info, full_scan, on_host)
+    remove(xml_file)
+
+    return host_count
+
+
+def nmap_ssa_scan(host, mac, mac_vendor, adjacency_switch, adjacency_int, addr_type, on_host=None):
 
     if addr_type == 'host':
-        xml_file = '%s%s.xml.%d' % (nmap_tmp_dir, host, int(time.time()))
-        port_scan = call([nmap,
-                          '-sS',
-                          '-A',
-                          host,
-                          '-Pn',
-                          '--open',
-                          '-oX',
-                          xml_file],
-                         shell=False,
-                         stdout=FNULL)
+        return run_nmap(['-sS', '-A', host, '-Pn', '--open'],
+                        host,
+                        (mac, mac_vendor, adjacency_switch, adjacency_int),
+                        on_host=on_host)
 
+    # a cider sweep is not the full scan the nmap_full profile of scan_cache stands for
     if addr_type == 'cider':
-        cider = host.replace('/', '_')
-        xml_file = '%s%s.xml.%d' % (nmap_tmp_dir, cider, int(time.time()))
-        port_scan = call([nmap,
-                          '-sS',
-                          '-sV',
-                          host,
-                          '--open',
-                          '-oX',
-                          xml_file],
-                         shell=False,
-                         stdout=FNULL)
-
-    if port_scan == 0:
-        return xml_file, mac, mac_vendor, adjacency_switch, adjacency_int
-
-    else:
-        return 99
+        return run_nmap(['-sS', '-sV', host, '--open'],
+                        host.replace('/', '_'),
+                        (mac, mac_vendor, adjacency_switch, adjacency_int),
+                        full_scan=False,
+                        on_host=on_host)
+
+    return 99
+
+
+def nmap_batch_scan(hosts, host_info):
+    """Scan a list of hosts with one nmap process, reading the targets from a file with -iL"""
+
+    scan_name = 'batch.%s.%d' % (hosts[0], len(hosts))
+    target_file = '%s%s.targets' % (nmap_tmp_dir, scan_name)
+
+    with open(target_file, 'w') as f:
+        f.write('\n'.join(hosts))
+
+    try:
+        host_count = run_nmap(['-sS',
+                               '-A',
+                               '-Pn',
+                               '--open',
+                               '--min-hostgroup', str(getattr(config, 'nmap_min_hostgroup', 64)),
+                               '--min-parallelism', str(getattr(config, 'nmap_min_parallelism', 16)),
+                               '-iL',
+                               target_file],
+                              scan_name,
+                              host_info=host_info)
+    finally:
+        remove(target_file)
+
+    return host_count
+
+
+class RunNmapBatch(object):
+    def __init__(self, host_info, force=False):
+        """Scan many hosts with a few nmap processes instead of one process per host,
+        host_info maps each ip address to its (mac, mac_vendor, adjacency_switch, adjacency_int)"""
+
+        self.host_info = host_info
+        hosts = scan_cache.not_fresh([h for h in host_info if Network.check_if_valid_address(h)], 'nmap_full', force)
+
+        processes = getattr(config, 'nmap_batch_processes', 4)
+        batch_size = max(int(math.ceil(len(hosts) / float(processes))), 1)
+
+        self.jobs = list()
+
+        for i in range(0, len(hosts), batch_size):
+            self.jobs.append(get_scan_queue().submit(hosts[i], self.run, hosts[i:i + batch_size]))
+
+    def join(self, timeout=None):
+        for job in self.jobs:
+            job.wait(timeout)
+
+    def run(self, hosts):
+
+        make_nmap_tmp_dir()
+
+        try:
+            host_count = nmap_batch_scan(hosts, self.host_info)
+
+            if host_count == 99 or host_count is None:
+                syslog.syslog(syslog.LOG_INFO, 'RunNmapBatch error: Could not run on %d hosts' % len(hosts))
+
+            else:
+                scan_cache.mark(hosts, 'nmap_full')
+
+        except (IOError, OSError, TypeError) as batch_e:
+            syslog.syslog(syslog.LOG_INFO, 'RunNmapBatch error: %s' % str(batch_e))
 
 
 class RunNmap(object):
-    def __init__(self, host, mac, mac_vendor, adjacency_switch, adjacency_int):
+    def __init__(self, host, mac, mac_vendor, adjacency_switch, adjacency_int, force=False):
         """Run the Nmap scanner based on the nmap configuration at the (config/nmap): mode"""
 
         self.host = host
@@ -125,162 +471,659 @@ class RunNmap(object):
         self.mac_vendor = mac_vendor
         self.adjacency_switch = adjacency_switch
         self.adjacency_int = adjacency_int
+        self.force = force
 
-        t = threading.Thread(target=self.run)
-        t.start()
+        self.job = get_scan_queue().submit(host, self.run)
+
+    def join(self, timeout=None):
+        self.job.wait(timeout)
 
     def run(self):
 
-        try:
-            makedirs(nmap_tmp_dir)
-        except OSError as os_e:
-            if os_e.errno == 17 and path.isdir(nmap_tmp_dir):
-                pass
-            else:
-                syslog.syslog(syslog.LOG_INFO, str(os_e))
+        make_nmap_tmp_dir()
 
         # Kick off the nmap scan
         try:
 
-            cider = Network.check_if_valid_cider(self.host)
-            ip_addr = Network.check_if_valid_address(self.host)
+            host, addr_type = Network.classify_target(self.host)
 
-            if ip_addr or cider:
-                addr_type = None
+            if addr_type:
+                self.host = host
 
-                if ip_addr:
-                    addr_type = 'host'
-                if cider:
-                    addr_type = 'cider'
+                if addr_type == 'host' and not scan_cache.not_fresh([self.host], 'nmap_full', self.force):
+                    return
 
-                nmap_scan_xml_path = nmap_ssa_scan(self.host,
-                                                   self.mac,
-                                                   self.mac_vendor,
-                                                   self.adjacency_switch,
-                                                   self.adjacency_int,
-                                                   addr_type)
+                host_count = nmap_ssa_scan(self.host,
+                                           self.mac,
+                                           self.mac_vendor,
+                                           self.adjacency_switch,
+                                           self.adjacency_int,
+                                           addr_type)
 
-                if nmap_scan_xml_path == 99:
+                if host_count == 99 or host_count is None:
                     syslog.syslog(syslog.LOG_INFO, 'RunNmap error: Could not run on %s %s' % (addr_type, self.host))
 
                 else:
-                    parse_nmap_xml(nmap_scan_xml_path)
-                    remove(nmap_scan_xml_path[0])
+                    if addr_type == 'host':
+                        scan_cache.mark([self.host], 'nmap_full')
 
         except TypeError as type_e:
             syslog.syslog(syslog.LOG_INFO, 'RunNmap error: %s' % str(type_e))
 
 
-class RunOpenVas(object):
-    def __init__(self, host, openvas_user_username, openvas_user_password):
-        self.host = host
+def host_ports(host):
+    """Split the ports nmap identified a product on of a live host into its tcp and udp ports"""
+
+    tcp_list = list()
+    udp_list = list()
+
+    for port in host.ports:
+
+        if port.cpe is None:
+            continue
+
+        if port.protocol == 'tcp':
+            tcp_list.append(port.portid)
+
+        if port.protocol == 'udp':
+            udp_list.append(port.portid)
+
+    return tcp_list, udp_list
+
+
+# the credential OpenVas logs in with, by the vendor and product of the nmap OS cpe
+lsc_os_cpes = (('smb', ('microsoft:windows',)),
+               ('ssh', ('linux', 'bsd', 'solaris', 'sunos', 'mac_os_x', 'aix', 'hp-ux', 'unix')))
+
+
+def host_lsc_type(host):
+    """'smb' for a Windows host, 'ssh' for a Linux or Unix host, None when nmap did not match the OS"""
+
+    product = decode_cpe(host.os_cpe)
+
+    if product is None:
+        return None
+
+    os_cpe = ('%s:%s' % (product.vendor, product.name or '')).lower()
+
+    for lsc_type, os_names in lsc_os_cpes:
+        for os_name in os_names:
+            if os_name in os_cpe:
+                return lsc_type
+
+
+# task statuses whose report is complete, or as complete as it will get
+openvas_finished_statuses = ('Done', 'Stopped', 'Interrupted')
+
+# task statuses of a task that is still queued or running, any other status, ie. Internal Error, is a failure
+openvas_active_statuses = ('New', 'Requested', 'Queued', 'Running', 'Stop Requested')
+
+
+class OpenVasTaskTracker(object):
+    def __init__(self, min_interval=5, max_interval=30, workers=2):
+        """Poll every running OpenVas task with one get_tasks call and hand finished tasks to
+        their callbacks on a small worker pool. The poll interval starts at min_interval and
+        doubles up to max_interval while nothing is close to done."""
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.pool = WorkerPool('OpenVasTaskTracker', workers)
+        self.tasks = dict()
+        self.new_tasks = False
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+
+        t = threading.Thread(target=self.run, name='OpenVasTaskTracker')
+        t.daemon = True
+        t.start()
+
+    def track(self, task_id, openvas_user_username, openvas_user_password, callback):
+        """Call callback(task_id, status) once the task finished or failed, status is None when
+        the task is gone"""
+
+        with self.lock:
+            self.tasks[task_id] = (openvas_user_username, openvas_user_password, callback)
+            self.new_tasks = True
+            self.wake.set()
+
+    def poll(self):
+        """Check all tracked tasks, returns True when the next poll should come soon"""
+
+        with self.lock:
+            tasks = dict(self.tasks)
+
+        soon = False
+
+        for user in set((u, p) for u, p, callback in tasks.values()):
+            statuses = get_task_statuses(user[0], user[1])
+
+            if not isinstance(statuses, dict):
+                continue
+
+            for task_id, (u, p, callback) in tasks.items():
+
+                if (u, p) != user:
+                    continue
+
+                status, progress = statuses.get(task_id, (None, -1))
+
+                if status not in openvas_active_statuses:
+
+                    if status not in openvas_finished_statuses:
+                        syslog.syslog(syslog.LOG_INFO, 'OpenVasTaskTracker error: task %s failed with status %s'
+                                      % (task_id, status))
+
+                    with self.lock:
+                        self.tasks.pop(task_id, None)
+
+                    self.pool.submit(callback, task_id, status)
+                    soon = True
+
+                elif progress >= 90:
+                    soon = True
+
+        return soon
+
+    def run(self):
+        interval = self.min_interval
+
+        while True:
+            # idle until there is a task to track
+            self.wake.wait()
+            time.sleep(interval)
+
+            try:
+                soon = self.poll()
+
+            except Exception as tracker_e:
+                syslog.syslog(syslog.LOG_INFO, 'OpenVasTaskTracker error: %s' % str(tracker_e))
+                soon = False
+
+            with self.lock:
+
+                if not self.tasks:
+                    self.wake.clear()
+                    interval = self.min_interval
+
+                elif soon or self.new_tasks:
+                    interval = self.min_interval
+
+                else:
+                    interval = min(interval * 2, self.max_interval)
+
+                self.new_tasks = False
+
+
+task_tracker = None
+task_tracker_lock = threading.Lock()
+
+
+def get_task_tracker():
+    """The OpenVas task tracker shared by every scan in this process"""
+
+    global task_tracker
+
+    with task_tracker_lock:
+        if task_tracker is None:
+            task_tracker = OpenVasTaskTracker(getattr(config, 'openvas_poll_min', 5),
+                                              getattr(config, 'openvas_poll_max', 30))
+
+    return task_tracker
+
+
+lsc_target_creators = {'ssh': create_targets_with_ssh_lsc,
+                       'smb': create_targets_with_smb_lsc}
+
+
+class OpenVasObjectCache(object):
+    def __init__(self, ttl=24*(60*60), gc_interval=60*60):
+        """Share OpenVas port lists and targets between scans. Both are named after a hash of their
+        content, so identical ones are reused instead of created and deleted per scan. Each is
+        reference counted, and collect() deletes targets that have been unused for ttl seconds
+        and then the port lists no cached target uses. Targets that log in with an ssh or smb
+        credential are cached apart from the ones that do not. The OMP calls are made without
+        the lock, an entry is busy while its object is created or deleted and others wait on it."""
+
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+        self.port_lists = dict()
+        self.targets = dict()
+        self.lock = threading.Condition()
+        self.last_gc = time.time()
+        self.adopted = False
+
+    @staticmethod
+    def content_key(*parts):
+        return hashlib.sha1('|'.join(parts).encode('utf8')).hexdigest()[:20]
+
+    def wait_idle(self, table, key):
+        """Return the entry of key once no other thread is creating or deleting it, or None,
+        called with the lock held"""
+
+        entry = table.get(key)
+
+        while entry is not None and entry['busy']:
+            self.lock.wait()
+            entry = table.get(key)
+
+        return entry
+
+    def adopt(self, openvas_user_username, openvas_user_password):
+        """Take over the perception port lists and targets left by an earlier run, once per process,
+        so they are reused or deleted by collect() instead of leaking"""
+
+        if self.adopted:
+            return
+
+        port_lists = list_port_lists('perception ports ', openvas_user_username, openvas_user_password)
+        targets = list_targets('perception target ', openvas_user_username, openvas_user_password)
+        creds = (openvas_user_username, openvas_user_password)
+        now = time.time()
+
+        with self.lock:
+
+            for name, port_list_id in port_lists:
+                self.port_lists.setdefault(name.split()[-1], {'id': port_list_id,
+                                                              'refs': 0,
+                                                              'busy': False,
+                                                              'creds': creds})
+
+            for name, target_id, port_list_name in targets:
+                key = name.split()[-1]
+                port_list_key = port_list_name.split()[-1] if port_list_name else None
+
+                if key in self.targets:
+                    continue
+
+                if port_list_key not in self.port_lists:
+                    port_list_key = None
+                else:
+                    self.port_lists[port_list_key]['refs'] += 1
+
+                self.targets[key] = {'id': target_id,
+                                     'refs': 0,
+                                     'busy': False,
+                                     'port_list': port_list_key,
+                                     'creds': creds,
+                                     'last_used': now}
+
+            self.adopted = True
+
+        syslog.syslog(syslog.LOG_INFO, 'OpenVasObjectCache info: adopted %d targets and %d port lists'
+                      % (len(targets), len(port_lists)))
+
+    def port_list(self, tcp_list, openvas_user_username, openvas_user_password):
+        """Return (key, port list) for the tcp ports with a reference taken on the port list,
+        or (None, None)"""
+
+        ports = sorted(set(tcp_list), key=int)
+        key = self.content_key('T', ','.join(ports))
+
+        with self.lock:
+            port_list = self.wait_idle(self.port_lists, key)
+
+            if port_list is not None:
+                port_list['refs'] += 1
+                return key, port_list
+
+            port_list = self.port_lists[key] = {'id': None,
+                                                'refs': 1,
+                                                'busy': True,
+                                                'creds': (openvas_user_username, openvas_user_password)}
+
+        name = 'perception ports %s' % key
+        port_list_id = None
+
+        try:
+            port_list_id = find_port_list(name, openvas_user_username, openvas_user_password) or \
+                create_port_list(name, openvas_user_username, openvas_user_password, ports, 'tcp')
+
+        finally:
+            with self.lock:
+                port_list['busy'] = False
+                port_list['id'] = port_list_id
+
+                if not port_list_id:
+                    del self.port_lists[key]
+
+                self.lock.notify_all()
+
+        if not port_list_id:
+            return None, None
+
+        return key, port_list
+
+    def acquire_target(self, hosts, tcp_list, openvas_user_username, openvas_user_password, lsc=None):
+        """Return (key, target id) of a target for the hosts and tcp ports, or (None, None),
+        release the key once the task using the target is deleted. lsc is an optional
+        (lsc type, credential id) the target logs in with."""
+
+        port_list_key, port_list = self.port_list(tcp_list, openvas_user_username, openvas_user_password)
+
+        if port_list is None:
+            return None, None
+
+        key = self.content_key(','.join(sorted(hosts)), port_list_key, *(lsc or ()))
+
+        with self.lock:
+            target = self.wait_idle(self.targets, key)
+
+            # the cached target already holds a reference on its port list
+            if target is not None:
+                port_list['refs'] -= 1
+                target['refs'] += 1
+                target['last_used'] = time.time()
+
+                return key, target['id']
+
+            target = self.targets[key] = {'id': None,
+                                          'refs': 1,
+                                          'busy': True,
+                                          'port_list': port_list_key,
+                                          'creds': (openvas_user_username, openvas_user_password),
+                                          'last_used': time.time()}
+
+        name = 'perception target %s' % key
+        target_id = None
+
+        try:
+            target_id = find_target(name, openvas_user_username, openvas_user_password)
+
+            if target_id is None and lsc is None:
+                target_id = create_target(name, openvas_user_username, openvas_user_password,
+                                          ', '.join(hosts), port_list['id'])
+
+            elif target_id is None:
+                target_id = lsc_target_creators[lsc[0]](name, openvas_user_username, openvas_user_password,
+                                                        lsc[1], hosts, port_list['id'])
+
+        finally:
+            with self.lock:
+                target['busy'] = False
+                target['id'] = target_id
+
+                if target_id is None:
+                    del self.targets[key]
+                    port_list['refs'] -= 1
+
+                self.lock.notify_all()
+
+        if target_id is None:
+            return None, None
+
+        return key, target_id
+
+    def release_target(self, key):
+
+        with self.lock:
+            target = self.targets.get(key)
+
+            if target is not None:
+                target['refs'] -= 1
+                target['last_used'] = time.time()
+
+        self.collect()
+
+    def delete(self, table, key, entry, delete_object):
+        """Delete the OpenVas object of a busy entry, dropping the entry if the manager deleted
+        it and making it idle again otherwise. Returns True when it was deleted."""
+
+        response = ''
+
+        try:
+            response = delete_object(entry['id'], *entry['creds'])
+
+        except Exception as delete_e:
+            syslog.syslog(syslog.LOG_INFO, 'OpenVasObjectCache error: %s' % str(delete_e))
+
+        # an object that is still used, ie. a target of a task, is kept until the next collection
+        deleted = 'status="2' in (response or '')
+
+        with self.lock:
+            entry['busy'] = False
+
+            if deleted:
+                del table[key]
+
+            self.lock.notify_all()
+
+        return deleted
+
+    def collect(self, force=False):
+        """Delete the targets unused for ttl seconds, then the port lists no target uses,
+        at most once every gc_interval seconds unless forced"""
+
+        now = time.time()
+
+        with self.lock:
+
+            if not force and now - self.last_gc < self.gc_interval:
+                return
+
+            self.last_gc = now
+
+            targets = [(key, target) for key, target in self.targets.items()
+                       if not target['busy'] and target['refs'] <= 0 and now - target['last_used'] >= self.ttl]
+
+            for key, target in targets:
+                target['busy'] = True
+
+        deleted = 0
+
+        for key, target in targets:
+
+            if self.delete(self.targets, key, target, delete_targets):
+                deleted += 1
+
+                with self.lock:
+                    if target['port_list'] in self.port_lists:
+                        self.port_lists[target['port_list']]['refs'] -= 1
+
+        with self.lock:
+            port_lists = [(key, port_list) for key, port_list in self.port_lists.items()
+                          if not port_list['busy'] and port_list['refs'] <= 0]
+
+            for key, port_list in port_lists:
+                port_list['busy'] = True
+
+        for key, port_list in port_lists:
+
+            if self.delete(self.port_lists, key, port_list, delete_port_list):
+                deleted += 1
+
+        if deleted:
+            syslog.syslog(syslog.LOG_INFO, 'OpenVasObjectCache info: deleted %d unused targets and port lists'
+                          % deleted)
+
+
+object_cache = None
+object_cache_lock = threading.Lock()
+
+
+def get_object_cache():
+    """The OpenVas port list and target cache shared by every scan in this process"""
+
+    global object_cache
+
+    with object_cache_lock:
+        if object_cache is None:
+            object_cache = OpenVasObjectCache(getattr(config, 'openvas_object_ttl', 24*(60*60)))
+
+    return object_cache
+
+
+class OpenVasScan(object):
+    def __init__(self, hosts, tcp_list, udp_list, openvas_user_username, openvas_user_password, lsc=None):
+        """Scan one or more hosts with the same ports in a single OpenVas task. start() gets a
+        shared target and starts the task, the task tracker calls finish() to parse the report,
+        delete the task and report and release the target. With lsc, a (lsc type, credential id),
+        the scan logs in to the hosts."""
+
+        self.hosts = hosts
+        self.tcp_list = tcp_list
+        self.udp_list = udp_list
+        self.lsc = lsc
         self.openvas_user_username = openvas_user_username
         self.openvas_user_password = openvas_user_password
+        self.target_key = None
+        self.target_id = None
+        self.task_id = None
+        self.xml_report_id = None
+        self.done = threading.Event()
 
-        t = threading.Thread(target=self.run)
-        t.start()
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
 
-    def scan(self):
+    def start(self):
         scan_ts = str(int(time.time()))
-        udp_list = list()
-        tcp_list = list()
-        tcp_port_list_id = False
-        udp_port_list_id = False
-
-        host_ipv4 = self.host['ipv4']
-        host_ipv6 = self.host['ipv6']
-
-        # build ports
-        for port in self.host['port_list']:
-
-            if port['protocol'] == 'tcp':
-                tcp_list.append(port['portid'])
-
-            if port['protocol'] == 'udp':
-                udp_list.append(port['portid'])
-
-        if udp_list:
-            syslog.syslog(syslog.LOG_INFO, 'host %s has a udp port list of: %s' % (str(host_ipv4), str(udp_list)))
-
-        if tcp_list:
-            tcp_port_list_id = create_port_list('%s.%s tcp ports' % (str(host_ipv4), scan_ts),
-                                                self.openvas_user_username,
-                                                self.openvas_user_password,
-                                                tcp_list,
-                                                'tcp')
-        if udp_list:
-            udp_port_list_id = create_port_list('%s.%s udp ports' % (str(host_ipv4), scan_ts),
-                                                self.openvas_user_username,
-                                                self.openvas_user_password,
-                                                udp_list,
-                                                'udp')
-
-        if tcp_port_list_id:
-            task_id = None
-
-            # create the targets to scan
-            target_id = create_target('%s.%s target' % (str(host_ipv4), scan_ts),
-                                      self.openvas_user_username,
-                                      self.openvas_user_password,
-                                      host_ipv4,
-                                      tcp_port_list_id)
-
-            task_name = '%s.%s scan' % (str(host_ipv4), scan_ts)
-
-            # setup the task
-            if target_id is not None:
-                task_id = create_task(task_name,
-                                      target_id,
-                                      '698f691e-7489-11df-9d8c-002264764cea',
-                                      self.openvas_user_username,
-                                      self.openvas_user_password)
-
-            # run the task
-            if task_id is not None:
-                xml_report_id = start_task(task_id, self.openvas_user_username, self.openvas_user_password)
-
-                if xml_report_id:
-
-                    # wait until the task is done
-                    while True:
-                        check_task_response = check_task(task_id, self.openvas_user_username,
-                                                         self.openvas_user_password)
-                        if check_task_response == 'Done' or check_task_response == 'Stopped':
-                            break
-                        time.sleep(60)
-
-                    # download and parse the report
-                    if xml_report_id is not None:
-                        get_report(xml_report_id, self.openvas_user_username, self.openvas_user_password)
-
-                    # delete the task
-                    if task_id is not None:
-                        delete_task(task_id, self.openvas_user_username, self.openvas_user_password)
-
-                    # delete the targets
-                    if target_id is not None:
-                        delete_targets(target_id, self.openvas_user_username, self.openvas_user_password)
-
-                    # delete the tcp_port_list_id
-                    if tcp_port_list_id is not None:
-                        delete_port_list(tcp_port_list_id, self.openvas_user_username,
-                                         self.openvas_user_password)
-
-                        # delete the udp_port_list_id
-                    if udp_port_list_id is not None:
-                        delete_port_list(udp_port_list_id, self.openvas_user_username,
-                                         self.openvas_user_password)
-
-                    # delete the report
-                    if xml_report_id is not None:
-                        delete_reports(xml_report_id, self.openvas_user_username,
-                                       self.openvas_user_password)
 
-    def run(self):
+        if len(self.hosts) == 1:
+            scan_name = '%s.%s' % (str(self.hosts[0]), scan_ts)
+        else:
+            scan_name = '%s+%d.%s' % (str(self.hosts[0]), len(self.hosts) - 1, scan_ts)
+
+        # wait here while the OpenVas database is being rebuilt
+        scan_gate.enter()
+
+        try:
+            if self.udp_list:
+                syslog.syslog(syslog.LOG_INFO, 'hosts %s have a udp port list of: %s'
+                              % (', '.join(self.hosts), str(self.udp_list)))
+
+            if self.tcp_list:
+
+                # get a target to scan
+                self.target_key, self.target_id = get_object_cache().acquire_target(self.hosts,
+                                                                                     self.tcp_list,
+                                                                                     self.openvas_user_username,
+                                                                                     self.openvas_user_password,
+                                                                                     self.lsc)
+
+                # setup the task
+                if self.target_id is not None:
+                    self.task_id = create_task('%s scan' % scan_name,
+                                               self.target_id,
+                                               '698f691e-7489-11df-9d8c-002264764cea',
+                                               self.openvas_user_username,
+                                               self.openvas_user_password)
+
+                # run the task
+                if self.task_id is not None:
+                    self.xml_report_id = start_task(self.task_id,
+                                                    self.openvas_user_username,
+                                                    self.openvas_user_password)
+
+                    if self.xml_report_id:
+                        get_task_tracker().track(self.task_id,
+                                                 self.openvas_user_username,
+                                                 self.openvas_user_password,
+                                                 self.finish)
+                        return
+
+                    delete_task(self.task_id, self.openvas_user_username, self.openvas_user_password)
+
+        except Exception as openvas_e:
+            syslog.syslog(syslog.LOG_INFO, 'OpenVasScan error: %s' % str(openvas_e))
+
+        if self.target_key is not None:
+            get_object_cache().release_target(self.target_key)
+
+        scan_gate.leave()
+        self.done.set()
+
+    def finish(self, task_id, status):
 
         try:
+            # download and parse the report, a failed task has none worth keeping
+            if status in openvas_finished_statuses:
+                get_report(self.xml_report_id,
+                           self.openvas_user_username,
+                           self.openvas_user_password,
+                           self.hosts)
+                scan_cache.mark(self.hosts, 'openvas')
+
+            # delete the task
+            delete_task(self.task_id, self.openvas_user_username, self.openvas_user_password)
+
+            # delete the report
+            delete_reports(self.xml_report_id, self.openvas_user_username, self.openvas_user_password)
+
+        except Exception as openvas_e:
+            syslog.syslog(syslog.LOG_INFO, 'OpenVasScan error: %s' % str(openvas_e))
+
+        finally:
+            # the target and its port list stay for the next scan of the same hosts and ports
+            get_object_cache().release_target(self.target_key)
+            scan_gate.leave()
+            self.done.set()
+
+
+class RunOpenVasBatch(object):
+    def __init__(self, hosts, openvas_user_username, openvas_user_password, force=False):
+        """Scan live hosts with shared OpenVas targets and tasks, hosts with the same open ports are
+        put in the same task, at most openvas_batch_size hosts per task. When ssh or smb credentials
+        are configured, hosts are also grouped by OS so Windows hosts are scanned with the smb
+        credential and Linux and Unix hosts with the ssh one."""
+
+        self.hosts = hosts
+        self.openvas_user_username = openvas_user_username
+        self.openvas_user_password = openvas_user_password
+        self.force = force
+        self.batch_size = max(1, getattr(config, 'openvas_batch_size', 32))
 
-            self.scan()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+    def group_hosts(self):
+        """Return a list of (hosts, tcp_list, udp_list, lsc), one for each task to run"""
+
+        stale = set(scan_cache.not_fresh([host.ipv4 for host in self.hosts], 'openvas', self.force))
+        credentials = lsc_credentials(self.openvas_user_username, self.openvas_user_password)
+        groups = dict()
+
+        for host in self.hosts:
+
+            if host.ipv4 not in stale:
+                continue
+
+            tcp_list, udp_list = host_ports(host)
+            lsc_type = host_lsc_type(host)
+
+            if lsc_type in credentials:
+                lsc = (lsc_type, credentials[lsc_type])
+            else:
+                lsc = None
+
+            key = (tuple(sorted(set(tcp_list))), tuple(sorted(set(udp_list))), lsc)
+            groups.setdefault(key, list()).append(host.ipv4)
+
+        batches = list()
+
+        for (tcp_ports, udp_ports, lsc), ips in groups.items():
+
+            for i in range(0, len(ips), self.batch_size):
+                batches.append((ips[i:i + self.batch_size], list(tcp_ports), list(udp_ports), lsc))
+
+        return batches
+
+    def run(self):
+
+        try:
+            batches = self.group_hosts()
 
         except Exception as openvas_e:
-            syslog.syslog(syslog.LOG_INFO, 'RunOpenVas error: %s' % str(openvas_e))
+            syslog.syslog(syslog.LOG_INFO, 'RunOpenVasBatch error: %s' % str(openvas_e))
+            return
+
+        # the tasks are started one after the other, the task tracker waits on all of them at once
+        scans = [OpenVasScan(hosts, tcp_list, udp_list, self.openvas_user_username, self.openvas_user_password, lsc)
+                 for hosts, tcp_list, udp_list, lsc in batches]
+
+        for scan in scans:
+            scan.start()
+
+        for scan in scans:
+            scan.wait()
@@ -2,15 +2,148 @@ from perception.config import configuration as config
 from pika import PlainCredentials, BlockingConnection, ConnectionParameters, BasicProperties, exceptions
 import threading
 import syslog
+import json
+from re import findall
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+# ---------------------
+# Message protocol info
+# ---------------------
+MESSAGE_VERSION = 1
+MESSAGE_CONTENT_TYPE = 'application/json'
+
+# command: {field: (type, required)}
+MESSAGE_SCHEMA = {'run_nmap': {'targets': (list, True),
+                               'force': (bool, False)},
+                  'run_openvas': {'targets': (list, True),
+                                  'force': (bool, False)},
+                  'send_to_elasticsearch': {'documents': (list, True)}}
+
+# legacy plain text prefixes, still accepted from older producers
+LEGACY_PREFIXES = (('run_nmap_on ', 'run_nmap'),
+                   ('run_openvas_on ', 'run_openvas'),
+                   ('send_to_elasticsearch ', 'send_to_elasticsearch'))
+
+
+def validate_message(message):
+    """Check a decoded message against MESSAGE_SCHEMA, return an error string or None"""
+
+    if not isinstance(message, dict):
+        return 'message is not an object'
+
+    if message.get('version') != MESSAGE_VERSION:
+        return 'unsupported message version: %s' % str(message.get('version'))
+
+    schema = MESSAGE_SCHEMA.get(message.get('command'))
+
+    if schema is None:
+        return 'unknown command: %s' % str(message.get('command'))
+
+    for field, (field_type, required) in schema.items():
+
+        if field not in message:
+            if required:
+                return 'missing field: %s' % field
+            continue
+
+        if not isinstance(message[field], field_type):
+            return 'field %s is not a %s' % (field, field_type.__name__)
+
+    if 'targets' in schema:
+        for target in message['targets']:
+            if not isinstance(target, string_types):
+                return 'target is not a string: %s' % str(target)
+
+    if 'documents' in schema:
+        for doc in message['documents']:
+            if not isinstance(doc, dict) or 'doc_type' not in doc or 'doc' not in doc:
+                return 'malformed document: %s' % str(doc)
+
+    return None
+
+
+def build_message(command, **payload):
+    """Encode a versioned message envelope, raises ValueError if it does not match the schema"""
+
+    message = {'version': MESSAGE_VERSION,
+               'command': command}
+    message.update(payload)
+
+    error = validate_message(message)
+    if error:
+        raise ValueError(error)
+
+    return json.dumps(message)
+
+
+def parse_legacy_message(body):
+    """Convert an old "command payload" text message into an envelope"""
+
+    for prefix, command in LEGACY_PREFIXES:
+
+        if not body.startswith(prefix):
+            continue
+
+        payload = body[len(prefix):]
+
+        if command == 'send_to_elasticsearch':
+            # send_to_elasticsearch |doc_type|doc_id|doc
+            fields = payload.split('|', 3)
+            if len(fields) != 4:
+                return None
+
+            try:
+                doc = json.loads(fields[3])
+            except ValueError:
+                doc = fields[3]
+
+            return {'version': MESSAGE_VERSION,
+                    'command': command,
+                    'documents': [{'doc_type': fields[1],
+                                   'doc_id': fields[2] or None,
+                                   'doc': doc}]}
+
+        # run_*_on ['10.1.1.1', '10.1.2.0/24']
+        return {'version': MESSAGE_VERSION,
+                'command': command,
+                'targets': findall(r'[\'"]([^\'"]+)[\'"]', payload)}
+
+    return None
+
+
+def parse_message(body):
+    """Decode and validate a message body, return the envelope dict or None"""
+
+    if isinstance(body, bytes) and not isinstance(body, str):
+        body = body.decode('utf8', 'ignore')
+
+    try:
+        message = json.loads(body)
+
+    except ValueError:
+        message = parse_legacy_message(body)
+
+    error = validate_message(message)
+
+    if error:
+        syslog.syslog(syslog.LOG_INFO, 'MessageBroker error: dropping message, %s' % error)
+        return None
+
+    return message
 
 
 class SendToRabbitMQ(object):
-    def __init__(self, body, exchange, routing):
-        """Send scan message to rabbitMQ"""
+    def __init__(self, body, exchange, routing, declare=None):
+        """Send scan message to rabbitMQ, body can be a single message or a list of messages"""
 
         self.body = body
         self.exchange = exchange
         self.routing = routing
+        self.declare = declare
 
         t = threading.Thread(target=self.run)
         t.start()
@@ -26,12 +159,19 @@ class SendToRabbitMQ(object):
 
             channel = connection.channel()
 
-            channel.basic_publish(exchange=self.exchange,
-                                  routing_key=self.routing,
-                                  body=self.body,
-                                  properties=BasicProperties(
-                                      delivery_mode=2
-                                  ))
+            if self.declare is not None:
+                self.declare(channel)
+
+            bodies = self.body if isinstance(self.body, list) else [self.body]
+
+            for body in bodies:
+                channel.basic_publish(exchange=self.exchange,
+                                      routing_key=self.routing,
+                                      body=body,
+                                      properties=BasicProperties(
+                                          content_type=MESSAGE_CONTENT_TYPE,
+                                          delivery_mode=2
+                                      ))
             connection.close()
 
         except exceptions.ChannelClosed as che:
@@ -8,9 +8,8 @@ from perception.database.models import OpenvasAdmin,\
     RSInfrastructure, \
     DiscoveryProtocolFinding
 from perception.classes import network
-from amqp import SendToRabbitMQ
+from cluster import send_command
 from sqlalchemy.exc import IntegrityError
-from socket import gethostbyaddr, herror
 from perception import db_session
 
 system_uuid = get_product_uuid()
@@ -180,10 +179,7 @@ def add_seeds(seed_info):
 
     if network.Network.check_if_valid_address(ipaddr):
 
-        try:
-            hostname = gethostbyaddr(ipaddr)[0]
-        except herror:
-            hostname = None
+        hostname = network.Network.hostname_lookup(ipaddr)
 
         add_svc_user = SvcUser(username=username,
                                description='Seed Router Service Account',
@@ -359,9 +355,8 @@ def cli_loop(prefix, mode, v):
                                 try:
                                     if cmd[2] == 'on':
 
-                                        SendToRabbitMQ('run_nmap_on %s' % cmd[3:],
-                                                       system_uuid,
-                                                       system_uuid)
+                                        targets = [t for t in cmd[3:] if t != 'force']
+                                        send_command('run_nmap', targets, force='force' in cmd[3:])
                                         continue
 
                                 except IndexError:
@@ -371,9 +366,8 @@ def cli_loop(prefix, mode, v):
                                 try:
                                     if cmd[2] == 'on':
 
-                                        SendToRabbitMQ('run_openvas_on %s' % cmd[3:],
-                                                       system_uuid,
-                                                       system_uuid)
+                                        targets = [t for t in cmd[3:] if t != 'force']
+                                        send_command('run_openvas', targets, force='force' in cmd[3:])
                                         continue
 
                                 except IndexError:
@@ -0,0 +1,115 @@
+from perception.config import configuration as config
+from perception.classes.amqp import SendToRabbitMQ, build_message
+from perception.classes.network import parse_network
+from perception.database.models import PerceptionNode
+from perception.shared.functions import get_product_uuid
+from datetime import datetime, timedelta
+from hashlib import sha1
+
+system_uuid = get_product_uuid()
+
+# ----------------
+# Cluster AMQP info
+# ----------------
+WORK_EXCHANGE = 'perception.work'
+WORK_QUEUES = {'run_nmap': 'perception.work.nmap',
+               'run_openvas': 'perception.work.openvas'}
+
+
+def cluster_mode():
+    return getattr(config, 'cluster_mode', False)
+
+
+def declare_work_queues(channel):
+    """Declare the shared durable exchange and work queues, safe to call from every node"""
+
+    channel.exchange_declare(exchange=WORK_EXCHANGE, type='direct', durable=True)
+
+    for command, queue_name in WORK_QUEUES.items():
+        channel.queue_declare(queue=queue_name, durable=True)
+        channel.queue_bind(exchange=WORK_EXCHANGE, queue=queue_name, routing_key=command)
+
+    return list(WORK_QUEUES.values())
+
+
+def split_cider(target, prefix):
+    """Split an IPv4 cider larger than /prefix into /prefix blocks"""
+
+    network = parse_network(target)
+
+    if network is None or network.version != 4 or network.prefixlen >= prefix:
+        return [target]
+
+    return [str(block) for block in network.subnets(new_prefix=prefix)]
+
+
+def partition_targets(targets, prefix=24, chunk_size=64):
+    """Split targets into work units, one per cider block and chunk_size hosts per unit"""
+
+    blocks = list()
+    hosts = list()
+
+    for target in targets:
+        if '/' in target:
+            blocks.extend([b] for b in split_cider(target, prefix))
+        else:
+            hosts.append(target)
+
+    return blocks + [hosts[i:i + chunk_size] for i in range(0, len(hosts), chunk_size)]
+
+
+def send_command(command, targets, **payload):
+    """Send a command to the shared work queues in cluster mode, or to this node"""
+
+    if cluster_mode() and command in WORK_QUEUES:
+        work_units = partition_targets(targets,
+                                       getattr(config, 'cluster_partition_prefix', 24),
+                                       getattr(config, 'cluster_chunk_size', 64))
+
+        return SendToRabbitMQ([build_message(command, targets=t, **payload) for t in work_units],
+                              WORK_EXCHANGE,
+                              command,
+                              declare=declare_work_queues)
+
+    return SendToRabbitMQ(build_message(command, targets=targets, **payload),
+                          system_uuid,
+                          system_uuid)
+
+
+def heartbeat(session):
+    """Record that this node is alive"""
+
+    node = session.query(PerceptionNode).filter(PerceptionNode.perception_product_uuid == system_uuid).first()
+
+    if node is None:
+        node = PerceptionNode(perception_product_uuid=system_uuid)
+        session.add(node)
+
+    node.last_seen_at = datetime.now()
+    session.commit()
+
+
+def live_nodes(session):
+    """Return the uuids of nodes that have sent a heartbeat within cluster_node_ttl seconds"""
+
+    seen_after = datetime.now() - timedelta(seconds=getattr(config, 'cluster_node_ttl', 300))
+
+    nodes = session.query(PerceptionNode.perception_product_uuid)\
+        .filter(PerceptionNode.last_seen_at >= seen_after).all()
+
+    return sorted(str(n.perception_product_uuid) for n in nodes)
+
+
+def shard_owner(key, nodes):
+    """Rendezvous hash a key onto one of the nodes, only keys of a lost node move when membership changes"""
+
+    return max(nodes, key=lambda node: sha1(('%s|%s' % (node, key)).encode()).hexdigest())
+
+
+def claim_shard(items, key, nodes):
+    """Return the items this node owns, key is called on each item to get its shard key"""
+
+    if system_uuid not in nodes:
+        nodes = nodes + [system_uuid]
+
+    return [i for i in items if shard_owner(str(key(i)), nodes) == system_uuid]
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict, namedtuple
+from perception.config import configuration as config
+
+# a decoded cpe, shared by every host, port and vulnerability with the same cpe
+CpeProduct = namedtuple('CpeProduct', 'cpe product_type vendor name version update edition language')
+
+# cpe 2.3 values that mean no value
+cpe23_any = ('*', '-', '')
+
+
+def split_cpe(cpe):
+    """Split a cpe 2.2 uri, ie. cpe:/a:openbsd:openssh:7.4, or a cpe 2.3 formatted string,
+    ie. cpe:2.3:a:openbsd:openssh:7.4:*:*:*:*:*:*:*, into a CpeProduct"""
+
+    if cpe.startswith('cpe:2.3:'):
+        parts = [None if part in cpe23_any else part for part in cpe.split(':')[2:9]]
+    else:
+        parts = cpe.split(':')[1:8]
+
+    parts.extend([None] * (7 - len(parts)))
+
+    return CpeProduct(cpe,
+                      (parts[0] or '').replace('/', ''),
+                      parts[1] or '',
+                      parts[2],
+                      parts[3],
+                      parts[4],
+                      parts[5],
+                      parts[6])
+
+
+class CpeCache(object):
+    def __init__(self, size=4096):
+        """Bounded least recently used cache of decoded cpes. A sweep sees the same few cpes on
+        every host, so each one is split once and the same CpeProduct is handed out after that."""
+
+        self.size = size
+        self.products = OrderedDict()
+        self.lock = threading.Lock()
+
+    def decode(self, cpe):
+        """Return the CpeProduct of a cpe, or None for an empty one"""
+
+        if not cpe:
+            return None
+
+        cpe = cpe.strip()
+
+        with self.lock:
+            product = self.products.pop(cpe, None)
+
+            if product is not None:
+                self.products[cpe] = product
+                return product
+
+        product = split_cpe(cpe)
+
+        with self.lock:
+            self.products[cpe] = product
+
+            while len(self.products) > self.size:
+                self.products.popitem(last=False)
+
+        return product
+
+
+cpe_cache = CpeCache(max(1, getattr(config, 'cpe_cache_size', 4096)))
+
+
+def decode_cpe(cpe):
+    """Decode a cpe through the process wide cache"""
+    return cpe_cache.decode(cpe)
@@ -20,83 +20,134 @@ from infrastructure import InterrogateRSI, sql, network, esearch
 from openvas import setup_openvas,\
     update_openvas_db,\
     migrate_rebuild_db
-from active_discovery import RunNmap, RunOpenVas, discover_live_hosts
+from active_discovery import RunNmap, RunOpenVasBatch, discover_live_hosts, get_object_cache
+from amqp import parse_message
+from workers import WorkerPool
+from resolver import get_resolver
+from cluster import cluster_mode, declare_work_queues, heartbeat, live_nodes, claim_shard
+from scheduler import Scheduler, DueTracker
 from sqlalchemy.exc import IntegrityError, ProgrammingError
-from re import match
 import threading
 import syslog
 import sys
 import atexit
 import pika
-import ast
 import json
+from functools import partial
+from abc import ABCMeta, abstractmethod
 from perception.shared.functions import get_product_uuid
 from perception import db_session
 
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
 system_uuid = get_product_uuid()
 
 
 class MessageBroker(object):
     def __init__(self, interval=5):
         self.interval = interval
+        self.prefetch = getattr(config, 'mq_prefetch', 8)
+        self.pool = WorkerPool('MessageBroker', getattr(config, 'mq_workers', 4))
 
         t = threading.Thread(target=self.run, args=())
         t.start()
 
     @staticmethod
-    def callback(ch, method, properties, body):
+    def get_openvas_admin():
+
+        # callbacks run on worker threads, so they do not share the daemon session
+        mb_db_session = sql.Sql.create_session()
 
         try:
-            openvas_admin = db_session.query(OpenvasAdmin).filter(OpenvasAdmin.perception_product_uuid == system_uuid).order_by(OpenvasAdmin.id.desc()).first()
+            openvas_admin = mb_db_session.query(OpenvasAdmin).filter(OpenvasAdmin.perception_product_uuid == system_uuid).order_by(OpenvasAdmin.id.desc()).first()
         except OperationalError as oe:
             syslog.syslog(syslog.LOG_INFO, 'Database OperationalError: %s' % oe)
             openvas_admin = False
 
-        sleep(body.count(b'.'))
+        mb_db_session.close()
+        return openvas_admin
 
-        run_nmap = match(r'^run_nmap_on ', body)
-        run_openvas = match(r'^run_openvas_on ', body)
-        send_to_elasticsearch = match(r'^send_to_elasticsearch ', body)
+    def callback(self, body):
 
-        if run_nmap:
-            host_list = body.strip('run_nmap_on ')
-            host_list = ast.literal_eval(host_list)
+        message = parse_message(body)
 
-            for host in host_list:
-                RunNmap(host, None, None, None, None)
+        if message is None:
+            return
 
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+        if message['command'] == 'run_nmap':
 
-        elif run_openvas:
-            host_list = body.strip('run_openvas_on ')
-            host_list = ast.literal_eval(host_list)
+            force = message.get('force', False)
+            targets, invalid = network.Network.validate_targets(message['targets'])
 
-            if openvas_admin:
+            if invalid:
+                syslog.syslog(syslog.LOG_INFO, 'MessageBroker info: dropping %d invalid nmap targets' % len(invalid))
+
+            scans = [RunNmap(host, None, None, None, None, force) for host in targets]
+
+            for scan in scans:
+                scan.join()
+
+        elif message['command'] == 'run_openvas':
+            openvas_admin = self.get_openvas_admin()
+
+            if not openvas_admin:
+                syslog.syslog(syslog.LOG_INFO, 'MessageBroker error: OpenVas is not configured, dropping vuln scan')
+                return
+
+            live_hosts = discover_live_hosts(message['targets'])
+
+            if live_hosts == 99 or live_hosts is None:
+                return
 
-                live_hosts = discover_live_hosts(host_list)
+            force = message.get('force', False)
+            RunOpenVasBatch(live_hosts, openvas_admin.username, openvas_admin.password, force).join()
 
-                for host in live_hosts:
+        elif message['command'] == 'send_to_elasticsearch':
 
-                    RunOpenVas(host, openvas_admin.username, openvas_admin.password)
+            esearch.Elasticsearch.bulk_index(config.es_host,
+                                             config.es_port,
+                                             config.es_index,
+                                             [(doc['doc_type'], doc.get('doc_id'), json.dumps(doc['doc']))
+                                              for doc in message['documents']])
+
+    def on_message(self, acks, ch, method, properties, body):
+        self.pool.submit(self.work, acks, method, body)
+
+    def work(self, acks, method, body):
+        """Run the message on a worker, then hand the ack back to the consumer thread"""
+
+        try:
+            self.callback(body)
+            acks.put((method.delivery_tag, True, False))
+
+        except Exception as work_e:
+            syslog.syslog(syslog.LOG_INFO, 'MessageBroker error: %s' % str(work_e))
+
+            # give a failed message one more delivery before dropping it
+            acks.put((method.delivery_tag, False, not method.redelivered))
+
+    @staticmethod
+    def flush_acks(channel, acks):
 
-                ch.basic_ack(delivery_tag=method.delivery_tag)
+        while not acks.empty():
+            delivery_tag, success, requeue = acks.get()
 
-        # TODO: this is breaking json for some reason
-        elif send_to_elasticsearch:
-             send_to_elasticsearch = body.split('|')
-             es_json_data = json.dumps(send_to_elasticsearch[3])
-             esearch.Elasticsearch.add_document(config.es_host,
-                                                config.es_port,
-                                                config.es_index,
-                                                send_to_elasticsearch[1],
-                                                send_to_elasticsearch[2],
-                                                es_json_data)
+            if success:
+                channel.basic_ack(delivery_tag=delivery_tag)
+            else:
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
 
     def run(self):
 
         while True:
             try:
 
+                # pika channels are not thread safe, workers pass acks back through this queue
+                acks = Queue()
+
                 credentials = pika.PlainCredentials(config.mq_user, config.mq_password)
                 connection = pika.BlockingConnection(pika.ConnectionParameters(host=config.mq_host,
                                                                                port=config.mq_port,
@@ -108,9 +159,17 @@ class MessageBroker(object):
                 queue_name = result.method.queue
                 channel.queue_bind(exchange=system_uuid, queue=queue_name, routing_key=system_uuid)
 
-                channel.basic_consume(self.callback, queue=queue_name)
+                channel.basic_qos(prefetch_count=self.prefetch)
+                channel.basic_consume(partial(self.on_message, acks), queue=queue_name)
+
+                # in cluster mode every node also takes jobs from the shared work queues
+                if cluster_mode():
+                    for work_queue in declare_work_queues(channel):
+                        channel.basic_consume(partial(self.on_message, acks), queue=work_queue)
 
-                channel.start_consuming()
+                while True:
+                    connection.process_data_events(time_limit=1)
+                    self.flush_acks(channel, acks)
 
             except Exception as MessageBroker_e:
                 syslog.syslog(syslog.LOG_INFO, 'MessageBroker error: %s' % str(MessageBroker_e))
@@ -118,251 +177,347 @@ class MessageBroker(object):
             sleep(self.interval)
 
 
-class OpenVasUpdater(object):
-    def __init__(self, interval=5*60):
+class ClusterHeartbeat(object):
+    def __init__(self, interval=60):
         self.interval = interval
-        t = threading.Thread(target=self.run, args=db_session)
+        t = threading.Thread(target=self.run, args=())
         t.start()
 
     def run(self):
 
+        hb_db_session = sql.Sql.create_session()
+
         while True:
 
             try:
+                heartbeat(hb_db_session)
 
-                try:
-                    # verify openvas is configured
-                    openvas_admin = db_session.query(OpenvasAdmin).filter(
-                        OpenvasAdmin.perception_product_uuid == system_uuid).order_by(OpenvasAdmin.id.desc()).first()
+            except Exception as heartbeat_e:
+                hb_db_session.rollback()
+                syslog.syslog(syslog.LOG_INFO, 'ClusterHeartbeat error: %s' % str(heartbeat_e))
 
-                except OperationalError as e:  # if it's not working
-                    syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater error: Could not Query for OpenVas Admin')
-                    syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater error: %s' % str(e))
-                    return
+            sleep(self.interval)
+
+
+# a base class with ABCMeta as its metaclass under both python 2 and 3
+ABC = ABCMeta('ABC', (object,), {})
+
+
+class IntervalDaemon(ABC):
+    """
+    Usage: subclass IntervalDaemon and implement run_once(). With a scheduler, run_once() is added as a job,
+    otherwise it runs on its own thread every interval seconds.
+    """
+    priority = 5
+
+    def __init__(self, interval, scheduler=None):
+        self.interval = interval
+
+        if scheduler is not None:
+            scheduler.add_job(self.__class__.__name__, self.run_once, interval, self.priority)
 
-                if openvas_admin is None:
+        else:
+            t = threading.Thread(target=self.run, args=())
+            t.start()
+
+    @abstractmethod
+    def run_once(self):
+        """One pass of the daemon's work"""
+
+    def run(self):
+
+        while True:
+            self.run_once()
+            sleep(self.interval)
+
+
+class OpenVasUpdater(IntervalDaemon):
+    priority = 4
+
+    def __init__(self, interval=5*60, scheduler=None):
+        self.maintenance = None
+        self.synced = False
+        super(OpenVasUpdater, self).__init__(interval, scheduler)
+
+    def update(self):
+        """Sync the feeds and rebuild the OpenVas database, scans wait while the manager is down.
+        A rebuild put off by running scans is retried on the next pass without syncing again."""
+
+        update_db_session = sql.Sql.create_session()
+
+        try:
+            if self.synced:
+                update_response = 0
+
+            else:
+                syslog.syslog(syslog.LOG_INFO,
+                              'OpenVasUpdater info: Updating OpenVas NVT,'
+                              ' SCAP and CERT database, this may take some time')
+
+                update_response = update_openvas_db()
+
+            if update_response == 0:
+                self.synced = True
+                syslog.syslog(syslog.LOG_INFO,
+                              'OpenVasUpdater info: Successfully updated OpenVas,'
+                              ' will now rebuild the database')
+
+                if migrate_rebuild_db() != 0:
                     syslog.syslog(syslog.LOG_INFO,
-                                  'OpenVasUpdater info: OpenVas needs to be configured, this may take up to an hour')
-                    ov_setup = setup_openvas()
+                                  'OpenVasUpdater info: The OpenVas database was not rebuilt, will retry')
+                    return
+
+                self.synced = False
+                syslog.syslog(syslog.LOG_INFO,
+                              'OpenVasUpdater info: Successfully rebuilt the OpenVas database')
+
+                add_update_info = OpenvasLastUpdate(updated_at=datetime.now(),
+                                                    perception_product_uuid=system_uuid)
+                update_db_session.add(add_update_info)
+                update_db_session.commit()
+                syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater info: Update is now complete')
+
+            elif update_response != 0:
+                syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater error: OpenVas update was not successful')
 
-                    if ov_setup == 99:
-                        syslog.syslog(syslog.LOG_INFO,
-                                      'OpenVasUpdater error: OpenVas failed setup')
-                        continue
+        except Exception as e:
+            update_db_session.rollback()
+            syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater error: %s' % str(e))
 
-                    if ov_setup != 99:
-                        syslog.syslog(syslog.LOG_INFO,
-                                      'OpenVasUpdater info: OpenVas is now setup and ready to use')
+        finally:
+            update_db_session.close()
 
-                # update openvas NVT's, CERT data, and CPE's once a day
-                one_day_ago = timezone(config.timezone).localize(datetime.now()) - timedelta(hours=24)
-                check_last_update = db_session.query(OpenvasLastUpdate).filter(
-                    OpenvasLastUpdate.perception_product_uuid == system_uuid).order_by(OpenvasLastUpdate.id.desc()).first()
+    def run_once(self):
+
+        try:
+
+            try:
+                # verify openvas is configured
+                openvas_admin = db_session.query(OpenvasAdmin).filter(
+                    OpenvasAdmin.perception_product_uuid == system_uuid).order_by(OpenvasAdmin.id.desc()).first()
 
-                if check_last_update is None or check_last_update.updated_at <= one_day_ago:
+            except OperationalError as e:  # if it's not working
+                syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater error: Could not Query for OpenVas Admin')
+                syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater error: %s' % str(e))
+                return
+
+            if openvas_admin is None:
+                syslog.syslog(syslog.LOG_INFO,
+                              'OpenVasUpdater info: OpenVas needs to be configured, this may take up to an hour')
+                ov_setup = setup_openvas()
+
+                if ov_setup == 99:
                     syslog.syslog(syslog.LOG_INFO,
-                                  'OpenVasUpdater info: Updating OpenVas NVT,'
-                                  ' SCAP and CERT database, this may take some time')
+                                  'OpenVasUpdater error: OpenVas failed setup')
+                    return
 
-                    try:
-                        update_response = update_openvas_db()
+                if ov_setup != 99:
+                    syslog.syslog(syslog.LOG_INFO,
+                                  'OpenVasUpdater info: OpenVas is now setup and ready to use')
 
-                        if update_response == 0:
-                            syslog.syslog(syslog.LOG_INFO,
-                                          'OpenVasUpdater info: Successfully updated OpenVas,'
-                                          ' will now rebuild the database')
+            # update openvas NVT's, CERT data, and CPE's once a day
+            one_day_ago = timezone(config.timezone).localize(datetime.now()) - timedelta(hours=24)
+            check_last_update = db_session.query(OpenvasLastUpdate).filter(
+                OpenvasLastUpdate.perception_product_uuid == system_uuid).order_by(OpenvasLastUpdate.id.desc()).first()
 
-                            migrate_rebuild_db()
-                            syslog.syslog(syslog.LOG_INFO,
-                                          'OpenVasUpdater info: Successfully rebuilt the OpenVas database')
+            if check_last_update is None or check_last_update.updated_at <= one_day_ago:
 
-                            add_update_info = OpenvasLastUpdate(updated_at=datetime.now(),
-                                                                perception_product_uuid=system_uuid)
-                            db_session.add(add_update_info)
-                            db_session.commit()
-                            syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater info: Update is now complete')
+                # the syncs and rebuild can take an hour, run them off the scheduler
+                if self.maintenance is None or not self.maintenance.is_alive():
+                    self.maintenance = threading.Thread(target=self.update, name='OpenVasUpdater-maintenance')
+                    self.maintenance.daemon = True
+                    self.maintenance.start()
 
-                        elif update_response != 0:
-                            syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater error: OpenVas update was not successful')
+            # take over the targets and port lists an earlier run left, then delete the ones scans stopped using
+            if openvas_admin:
+                get_object_cache().adopt(openvas_admin.username, openvas_admin.password)
 
-                    except Exception as e:
-                        db_session.rollback()
-                        syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater error: %s' % str(e))
+            get_object_cache().collect()
 
-            except Exception as openvas_updater_e:
-                syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater error: %s' % str(openvas_updater_e))
+        except Exception as openvas_updater_e:
+            syslog.syslog(syslog.LOG_INFO, 'OpenVasUpdater error: %s' % str(openvas_updater_e))
 
-            sleep(self.interval)
 
+class RSInventoryUpdater(IntervalDaemon):
+    priority = 3
 
-class RSInventoryUpdater(object):
-    def __init__(self, interval=6*(60*60)):
-        self.interval = interval
-        t = threading.Thread(target=self.run, args=())
-        t.start()
+    def __init__(self, interval=6*(60*60), scheduler=None, pass_interval=5*60):
+        """Re-interrogate each device interval seconds after it was last interrogated,
+        checking for due devices every pass_interval seconds"""
 
-    def run(self):
+        self.due_tracker = DueTracker(interval)
+        super(RSInventoryUpdater, self).__init__(pass_interval, scheduler)
 
-        while True:
+    def run_once(self):
 
-            try:
+        try:
 
-                rsinventory = db_session.query(RSInfrastructure).all()
+            rsinventory = db_session.query(RSInfrastructure).all()
 
-                for r in rsinventory:
+            # each node sweeps only its own slice of the inventory
+            if cluster_mode():
+                rsinventory = claim_shard(rsinventory, lambda r: r.ip_addr, live_nodes(db_session))
 
-                    InterrogateRSI(r.host_name,
-                                   r.ip_addr,
-                                   r.svc_users.username,
-                                   r.svc_user_id)
+            self.due_tracker.forget([r.ip_addr for r in rsinventory])
+            due = set(self.due_tracker.due([r.ip_addr for r in rsinventory]))
 
-            except ProgrammingError:
-                syslog.syslog(syslog.LOG_INFO, 'RSInventorySpider() can not read from the database.')
+            for r in rsinventory:
 
-            sleep(self.interval)
+                if r.ip_addr not in due:
+                    continue
 
+                InterrogateRSI(r.host_name,
+                               r.ip_addr,
+                               r.svc_users.username,
+                               r.svc_user_id)
 
-class DiscoveryProtocolSpider(object):
-    def __init__(self, interval=120):
-        self.interval = interval
-        t = threading.Thread(target=self.run, args=())
-        t.start()
+                self.due_tracker.completed(r.ip_addr)
 
-    def run(self):
+        except ProgrammingError:
+            syslog.syslog(syslog.LOG_INFO, 'RSInventorySpider() can not read from the database.')
 
-        while True:
 
-            try:
+class DiscoveryProtocolSpider(IntervalDaemon):
+    priority = 2
 
-                discovery_findings = db_session.query(DiscoveryProtocolFinding)\
-                    .filter(DiscoveryProtocolFinding.ip_addr != None) \
-                    .filter(DiscoveryProtocolFinding.platform != 'VMware ESX')\
-                    .filter(DiscoveryProtocolFinding.capabilities.ilike('%Switch%')).all()
+    def __init__(self, interval=120, scheduler=None):
+        super(DiscoveryProtocolSpider, self).__init__(interval, scheduler)
 
-                for finding in discovery_findings:
-                    rtr_list = list()
+    def run_once(self):
 
-                    do_not_seed = db_session.query(DoNotSeed).filter(DoNotSeed.ip_addr == finding.ip_addr).first()
-                    if do_not_seed:
-                        if do_not_seed.ip_addr not in rtr_list:
-                            rtr_list.append(do_not_seed.ip_addr)
+        try:
 
-                    host_with_bad_key = db_session.query(HostWithBadSshKey).filter(HostWithBadSshKey.ip_addr == finding.ip_addr).first()
-                    if host_with_bad_key:
-                        if host_with_bad_key.ip_addr not in rtr_list:
-                            rtr_list.append(host_with_bad_key.ip_addr)
+            discovery_findings = db_session.query(DiscoveryProtocolFinding)\
+                .filter(DiscoveryProtocolFinding.ip_addr != None) \
+                .filter(DiscoveryProtocolFinding.platform != 'VMware ESX')\
+                .filter(DiscoveryProtocolFinding.capabilities.ilike('%Switch%')).all()
 
-                    host_using_sshv1 = db_session.query(HostUsingSshv1).filter(HostUsingSshv1.ip_addr == finding.ip_addr).first()
-                    if host_using_sshv1:
-                        if host_using_sshv1.ip_addr not in rtr_list:
-                            rtr_list.append(host_using_sshv1.ip_addr)
+            new_findings = list()
 
-                    rsiaddr_exists = db_session.query(RSAddr).filter(RSAddr.ip_addr == finding.ip_addr).first()
-                    if rsiaddr_exists:
-                        if rsiaddr_exists.ip_addr not in rtr_list:
-                            rtr_list.append(rsiaddr_exists.ip_addr)
+            for finding in discovery_findings:
+                rtr_list = list()
 
-                    if not rtr_list:
+                do_not_seed = db_session.query(DoNotSeed).filter(DoNotSeed.ip_addr == finding.ip_addr).first()
+                if do_not_seed:
+                    if do_not_seed.ip_addr not in rtr_list:
+                        rtr_list.append(do_not_seed.ip_addr)
 
-                        try:
-                            hostname = network.Network.hostname_lookup(finding.ip_addr)
+                host_with_bad_key = db_session.query(HostWithBadSshKey).filter(HostWithBadSshKey.ip_addr == finding.ip_addr).first()
+                if host_with_bad_key:
+                    if host_with_bad_key.ip_addr not in rtr_list:
+                        rtr_list.append(host_with_bad_key.ip_addr)
 
-                            find_seed_account = db_session.query(SvcUser).filter(SvcUser.description == 'Seed Router Service Account').first()
+                host_using_sshv1 = db_session.query(HostUsingSshv1).filter(HostUsingSshv1.ip_addr == finding.ip_addr).first()
+                if host_using_sshv1:
+                    if host_using_sshv1.ip_addr not in rtr_list:
+                        rtr_list.append(host_using_sshv1.ip_addr)
 
-                            is_ip_addr_in_seed = db_session.query(SeedRouter).filter(SeedRouter.ip_addr == finding.ip_addr).first()
+                rsiaddr_exists = db_session.query(RSAddr).filter(RSAddr.ip_addr == finding.ip_addr).first()
+                if rsiaddr_exists:
+                    if rsiaddr_exists.ip_addr not in rtr_list:
+                        rtr_list.append(rsiaddr_exists.ip_addr)
 
-                            if is_ip_addr_in_seed is None:
+                if not rtr_list:
+                    new_findings.append(finding)
 
-                                add_to_seed = SeedRouter(ip_addr=finding.ip_addr,
-                                                         svc_user_id=find_seed_account.id,
-                                                         host_name=hostname,
-                                                         perception_product_uuid=system_uuid)
-                                db_session.add(add_to_seed)
-                                db_session.commit()
+            # look up the names of every new seed at once, so slow PTR zones cost one timeout per pass
+            hostnames = get_resolver().lookup_many([finding.ip_addr for finding in new_findings])
 
-                        except IntegrityError:
-                            db_session.rollback()
+            for finding in new_findings:
 
-                        except Exception as d_e:
-                            db_session.rollback()
-                            syslog.syslog(syslog.LOG_INFO, str(d_e))
+                try:
+                    hostname = hostnames.get(finding.ip_addr)
 
-            except ProgrammingError:
-                syslog.syslog(syslog.LOG_INFO, 'DiscoveryProtocolSpider() can not read from the database.')
+                    find_seed_account = db_session.query(SvcUser).filter(SvcUser.description == 'Seed Router Service Account').first()
 
-            sleep(self.interval)
+                    is_ip_addr_in_seed = db_session.query(SeedRouter).filter(SeedRouter.ip_addr == finding.ip_addr).first()
 
+                    if is_ip_addr_in_seed is None:
 
-class SeedStarter(object):
-    def __init__(self, interval=15):
-        self.interval = interval
-        t = threading.Thread(target=self.run, args=())
-        t.start()
+                        add_to_seed = SeedRouter(ip_addr=finding.ip_addr,
+                                                 svc_user_id=find_seed_account.id,
+                                                 host_name=hostname,
+                                                 perception_product_uuid=system_uuid)
+                        db_session.add(add_to_seed)
+                        db_session.commit()
 
-    def run(self):
+                except IntegrityError:
+                    db_session.rollback()
 
-        while True:
+                except Exception as d_e:
+                    db_session.rollback()
+                    syslog.syslog(syslog.LOG_INFO, str(d_e))
 
-            try:
+        except ProgrammingError:
+            syslog.syslog(syslog.LOG_INFO, 'DiscoveryProtocolSpider() can not read from the database.')
+
+
+class SeedStarter(IntervalDaemon):
+    priority = 1
+
+    def __init__(self, interval=15, scheduler=None):
+        super(SeedStarter, self).__init__(interval, scheduler)
+
+    def run_once(self):
+
+        try:
+
+            seed_routers = db_session.query(SeedRouter).all()
+            if seed_routers is not None:
+
+                for i in seed_routers:
+                    rtr_list = list()
+
+                    do_not_seed = db_session.query(DoNotSeed).filter(DoNotSeed.ip_addr == i.ip_addr).first()
+                    if do_not_seed:
+                        if do_not_seed.ip_addr not in rtr_list:
+                            rtr_list.append(do_not_seed.ip_addr)
+
+                    rsaddr_exists = db_session.query(RSAddr).filter(RSAddr.ip_addr == i.ip_addr).first()
+                    if rsaddr_exists:
+                        if rsaddr_exists.ip_addr not in rtr_list:
+                            rtr_list.append(rsaddr_exists.ip_addr)
+
+                    host_with_bad_key = db_session.query(HostWithBadSshKey).filter(HostWithBadSshKey.ip_addr == i.ip_addr).first()
+                    if host_with_bad_key:
+                        if host_with_bad_key.ip_addr not in rtr_list:
+                            rtr_list.append(host_with_bad_key.ip_addr)
+
+                    host_using_sshv1 = db_session.query(HostUsingSshv1).filter(HostUsingSshv1.ip_addr == i.ip_addr).first()
+                    if host_using_sshv1:
+                        if host_using_sshv1.ip_addr not in rtr_list:
+                            rtr_list.append(host_using_sshv1.ip_addr)
+
+                    if rtr_list:
 
-                seed_routers = db_session.query(SeedRouter).all()
-                if seed_routers is not None:
-
-                    for i in seed_routers:
-                        rtr_list = list()
-
-                        do_not_seed = db_session.query(DoNotSeed).filter(DoNotSeed.ip_addr == i.ip_addr).first()
-                        if do_not_seed:
-                            if do_not_seed.ip_addr not in rtr_list:
-                                rtr_list.append(do_not_seed.ip_addr)
-
-                        rsaddr_exists = db_session.query(RSAddr).filter(RSAddr.ip_addr == i.ip_addr).first()
-                        if rsaddr_exists:
-                            if rsaddr_exists.ip_addr not in rtr_list:
-                                rtr_list.append(rsaddr_exists.ip_addr)
-
-                        host_with_bad_key = db_session.query(HostWithBadSshKey).filter(HostWithBadSshKey.ip_addr == i.ip_addr).first()
-                        if host_with_bad_key:
-                            if host_with_bad_key.ip_addr not in rtr_list:
-                                rtr_list.append(host_with_bad_key.ip_addr)
-
-                        host_using_sshv1 = db_session.query(HostUsingSshv1).filter(HostUsingSshv1.ip_addr == i.ip_addr).first()
-                        if host_using_sshv1:
-                            if host_using_sshv1.ip_addr not in rtr_list:
-                                rtr_list.append(host_using_sshv1.ip_addr)
-
-                        if rtr_list:
-
-                            try:
-                                db_session.delete(i)
-                                db_session.commit()
-                                continue
-                            except Exception as e:
-                                syslog.syslog(syslog.LOG_INFO,
-                                              'PerceptionD Exception caught trying to delete %s from SeedRouter with addr %s'
-                                              % (str(i.id), str(i.ip_addr)))
-                                syslog.syslog(syslog.LOG_INFO, str(e))
-                                db_session.rollback()
-                                continue
-
-                        # if so get info
                         try:
+                            db_session.delete(i)
+                            db_session.commit()
+                            continue
+                        except Exception as e:
+                            syslog.syslog(syslog.LOG_INFO,
+                                          'PerceptionD Exception caught trying to delete %s from SeedRouter with addr %s'
+                                          % (str(i.id), str(i.ip_addr)))
+                            syslog.syslog(syslog.LOG_INFO, str(e))
+                            db_session.rollback()
+                            continue
 
-                            # get info from seed
-                            InterrogateRSI(i.host_name,
-                                           i.ip_addr,
-                                           i.svc_users.username,
-                                           i.svc_user_id,
-                                           True)
+                    # if so get info
+                    try:
 
-                        except Exception as seed_e:
-                            syslog.syslog(syslog.LOG_INFO, 'InterrogateRSI Exception caught' % seed_e)
-                            return
+                        # get info from seed
+                        InterrogateRSI(i.host_name,
+                                       i.ip_addr,
+                                       i.svc_users.username,
+                                       i.svc_user_id,
+                                       True)
 
-            except ProgrammingError:
-                syslog.syslog(syslog.LOG_INFO, 'SeedStarter() can not read from the database.')
+                    except Exception as seed_e:
+                        syslog.syslog(syslog.LOG_INFO, 'InterrogateRSI Exception caught' % seed_e)
+                        return
 
-            sleep(self.interval)
+        except ProgrammingError:
+            syslog.syslog(syslog.LOG_INFO, 'SeedStarter() can not read from the database.')
 
 
 class PerceptionDaemon(object):
@@ -492,8 +647,13 @@ class PerceptionDaemon(object):
         You should override this method when you subclass PerceptionDaemon. It will be called after the process has been
         daemonized by start() or restart().
         """
-        SeedStarter()
-        DiscoveryProtocolSpider()
-        RSInventoryUpdater()
-        OpenVasUpdater()
+        if cluster_mode():
+            ClusterHeartbeat()
+
+        scheduler = Scheduler(getattr(config, 'scheduler_max_concurrency', 3))
+
+        SeedStarter(scheduler=scheduler)
+        DiscoveryProtocolSpider(scheduler=scheduler)
+        RSInventoryUpdater(scheduler=scheduler)
+        OpenVasUpdater(scheduler=scheduler)
         MessageBroker()
@@ -66,3 +66,60 @@ class Elasticsearch(object):
         except Exception as es_add_data_e:
             syslog.syslog(syslog.LOG_INFO, 'es_add_document error: %s' % str(es_add_data_e))
             syslog.syslog(syslog.LOG_INFO, 'es_add_document event: %s' % str(str(doc)))
+
+    @staticmethod
+    def bulk_index(es_host, es_port, doc_index, docs):
+        """Index many documents with one _bulk request, docs are (doc_type, doc_id, doc) with doc
+        the json text. Returns the number of documents that failed."""
+
+        if not docs:
+            return 0
+
+        lines = list()
+
+        for doc_type, doc_id, doc in docs:
+            action = {'_index': doc_index,
+                      '_type': doc_type}
+
+            if doc_id is not None:
+                action['_id'] = doc_id
+
+            lines.append(json.dumps({'index': action}))
+            lines.append(doc)
+
+        try:
+            headers = {'Accept': 'text/plain',
+                       'Content-type': 'application/x-ndjson'}
+
+            conn = httplib.HTTPConnection(es_host,
+                                          es_port)
+
+            conn.request('POST', '/_bulk',
+                         headers=headers,
+                         body='\n'.join(lines) + '\n')
+
+            resp = conn.getresponse()
+            data = resp.read()
+
+            json_resp = json.loads(data)
+
+            if resp.status != 200:
+                syslog.syslog(syslog.LOG_INFO, str(json_resp))
+                return len(docs)
+
+            failed = 0
+
+            if json_resp.get('errors'):
+                for item in json_resp.get('items', list()):
+                    result = item.get('index', dict())
+
+                    if 'error' in result:
+                        failed += 1
+                        syslog.syslog(syslog.LOG_INFO, str(result))
+
+            return failed
+
+        except Exception as es_bulk_e:
+            syslog.syslog(syslog.LOG_INFO, 'es_bulk_index error: %s' % str(es_bulk_e))
+            syslog.syslog(syslog.LOG_INFO, 'es_bulk_index events: %d documents' % len(docs))
+            return len(docs)
@@ -0,0 +1,147 @@
+from perception.database.models import OpenVasReport, OpenVasNvt, OpenVasCve, OpenVasNvtCve, OpenVasFinding
+from perception.shared.functions import get_product_uuid
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import insert
+
+system_uuid = get_product_uuid()
+
+
+def _float(value):
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _cve_ids(cve):
+    """Split the cve text of an NVT, ie. 'CVE-2017-0143, CVE-2017-0144' or 'NOCVE'"""
+
+    if not cve:
+        return []
+
+    return [c.strip() for c in cve.split(',') if c.strip().startswith('CVE-')]
+
+
+def _get_or_insert(session, model, column, values, rows):
+    """Return {value: id} for the values of column, inserting the missing rows in one statement.
+    Rows another report inserted meanwhile are skipped by the unique column and read back."""
+
+    if not values:
+        return dict()
+
+    ids = dict(session.query(column, model.id).filter(column.in_(values)).all())
+    missing = [rows[v] for v in values if v not in ids]
+
+    if missing:
+        session.execute(insert(model.__table__).values(missing).on_conflict_do_nothing(index_elements=[column.key]))
+        ids.update(session.query(column, model.id).filter(column.in_([row[column.key] for row in missing])).all())
+
+    return ids
+
+
+def save_findings(session, report_id, hosts):
+    """Store every vulnerability of a report as a finding row, and compare each host's findings with
+    its previous report. hosts is a list of (OpenVasVuln, vulnerability list) and the vulnerabilities
+    are the dicts built by add_openvas_result. Returns {ip_addr: {'new': [...], 'fixed': [...]}} with
+    (oid, port) pairs."""
+
+    report = session.query(OpenVasReport).filter(OpenVasReport.report_id == report_id).first()
+
+    if report is None:
+        report = OpenVasReport(report_id=report_id, perception_product_uuid=system_uuid, created_at=datetime.now())
+        session.add(report)
+        session.flush()
+
+    # NVTs and CVEs are shared by all reports, insert the ones not seen before
+    nvt_rows = dict()
+    cve_rows = dict()
+    nvt_cves = dict()
+
+    for openvas_vuln, vulns in hosts:
+        for v in vulns:
+            oid = v.get('openvas_vuln_oid')
+
+            if oid is None or oid in nvt_rows:
+                continue
+
+            nvt_rows[oid] = {'oid': oid,
+                             'name': v['openvas_vuln_name'],
+                             'family': v['openvas_vuln_family'],
+                             'cvss_base': _float(v['openvas_vuln_cvss_score']),
+                             'bid': v['openvas_vuln_bug_id'],
+                             'xrefs': v['openvas_vuln_xrefs'],
+                             'tags': v['openvas_vuln_tags']}
+
+            nvt_cves[oid] = _cve_ids(v['openvas_vuln_cve_id'])
+
+            for cve_id in nvt_cves[oid]:
+                cve_rows[cve_id] = {'cve_id': cve_id}
+
+    nvt_ids = _get_or_insert(session, OpenVasNvt, OpenVasNvt.oid, list(nvt_rows), nvt_rows)
+    cve_ids = _get_or_insert(session, OpenVasCve, OpenVasCve.cve_id, list(cve_rows), cve_rows)
+
+    if nvt_ids:
+        linked = set(session.query(OpenVasNvtCve.openvas_nvt_id, OpenVasNvtCve.openvas_cve_id).filter(
+            OpenVasNvtCve.openvas_nvt_id.in_(list(nvt_ids.values()))).all())
+        links = set((nvt_ids[oid], cve_ids[c]) for oid, cves in nvt_cves.items() for c in cves)
+        new_links = [{'openvas_nvt_id': n, 'openvas_cve_id': c} for n, c in links - linked]
+
+        if new_links:
+            session.execute(insert(OpenVasNvtCve.__table__).values(new_links).on_conflict_do_nothing())
+
+    # the findings of each host's previous report
+    previous = dict()
+    previous_reports = dict((openvas_vuln.id, openvas_vuln.last_report_id) for openvas_vuln, vulns in hosts
+                            if openvas_vuln.last_report_id is not None and openvas_vuln.last_report_id != report.id)
+
+    if previous_reports:
+        for vuln_id, previous_report_id, oid, port in session.query(OpenVasFinding.openvas_vuln_id,
+                                                                    OpenVasFinding.openvas_report_id,
+                                                                    OpenVasNvt.oid,
+                                                                    OpenVasFinding.port).join(
+                OpenVasNvt, OpenVasFinding.openvas_nvt_id == OpenVasNvt.id).filter(
+                OpenVasFinding.openvas_vuln_id.in_(list(previous_reports)),
+                OpenVasFinding.openvas_report_id.in_(list(set(previous_reports.values())))):
+
+            if previous_reports[vuln_id] == previous_report_id:
+                previous.setdefault(vuln_id, set()).add((oid, port))
+
+    finding_rows = list()
+    diffs = dict()
+    now = datetime.now()
+
+    for openvas_vuln, vulns in hosts:
+        before = previous.get(openvas_vuln.id, set())
+        current = set()
+
+        for v in vulns:
+            oid = v.get('openvas_vuln_oid')
+
+            if oid is None:
+                continue
+
+            key = (oid, v['openvas_vuln_port'])
+
+            if key in current:
+                continue
+
+            current.add(key)
+            finding_rows.append({'openvas_report_id': report.id,
+                                 'openvas_vuln_id': openvas_vuln.id,
+                                 'openvas_nvt_id': nvt_ids[oid],
+                                 'port': v['openvas_vuln_port'],
+                                 'threat': v['openvas_vuln_threat_score'],
+                                 'severity': _float(v['openvas_vuln_severity_score']),
+                                 'is_new': key not in before,
+                                 'created_at': now})
+
+        diffs[openvas_vuln.ip_addr] = {'new': sorted(current - before),
+                                       'fixed': sorted(before - current)}
+        openvas_vuln.last_report_id = report.id
+
+    if finding_rows:
+        session.execute(OpenVasFinding.__table__.insert(), finding_rows)
+
+    session.commit()
+    return diffs
@@ -941,6 +941,8 @@ class InterrogateRSI(object):
                                                rsi_json_data)
 
         if config.discovery_mode == 'active':
+            host_info = dict()
+
             for h in local_host_dict_list:
 
                 mac_lookup_string = h['local_host_mac_addr'].replace('.', '')
@@ -953,11 +955,14 @@ class InterrogateRSI(object):
                 except CalledProcessError:
                     mac_vendor = None
 
-                active_discovery.RunNmap(h['local_host_ip_addr'],
-                                         h['local_host_mac_addr'],
-                                         mac_vendor,
-                                         '%s (%s)' % (rsi.ip_addr, rsi.host_name),
-                                         h['local_host_adjacency_int'])
+                host_info[h['local_host_ip_addr']] = (h['local_host_mac_addr'],
+                                                      mac_vendor,
+                                                      '%s (%s)' % (rsi.ip_addr, rsi.host_name),
+                                                      h['local_host_adjacency_int'])
+
+            # scan all the local hosts with a few batched nmap processes
+            if host_info:
+                active_discovery.RunNmapBatch(host_info)
 
         rsi_db_session.close()
         return
@@ -1,5 +1,63 @@
-from re import match
-from socket import gethostbyaddr, herror
+import ipaddress
+from socket import inet_pton, inet_ntop, AF_INET, AF_INET6, error as socket_error
+from collections import OrderedDict
+from perception.classes.resolver import reverse_lookup
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+
+def _text(value):
+    """ipaddress only takes text, py2 strs are decoded first"""
+
+    if isinstance(value, text_type):
+        return value
+
+    if isinstance(value, bytes):
+        return value.decode('ascii')
+
+    raise ValueError('not a string: %s' % repr(value))
+
+
+def normalize_address(value):
+    """Return the compressed text of an IPv4 or IPv6 address, or None. An ipv6 zone, ie. fe80::1%eth0,
+    is kept. Addresses are checked with inet_pton, which is strict and much faster than parsing them
+    with ipaddress."""
+
+    try:
+        address, sep, zone = value.partition('%')
+
+        if sep and not zone:
+            return None
+
+        if ':' in address:
+            return inet_ntop(AF_INET6, inet_pton(AF_INET6, address)) + sep + zone
+
+        if not sep:
+            return inet_ntop(AF_INET, inet_pton(AF_INET, address))
+
+    except (socket_error, ValueError, TypeError, AttributeError):
+        pass
+
+    return None
+
+
+def parse_network(value):
+    """Return the IPv4Network or IPv6Network of an address/prefix value, or None. Host bits may be
+    set, ie. 10.1.1.5/24 is 10.1.1.0/24."""
+
+    try:
+        text = _text(value)
+
+        if '/' not in text:
+            return None
+
+        return ipaddress.ip_network(text, strict=False)
+
+    except (ValueError, UnicodeError):
+        return None
 
 
 class Network(object):
@@ -11,59 +69,56 @@ class Network(object):
 
     @staticmethod
     def hostname_lookup(ip_addr):
-        try:
-            hostname = gethostbyaddr(ip_addr)[0]
-        except herror:
-            hostname = None
-
-        return hostname
+        """Reverse lookup through the shared caching resolver, None when there is no name"""
+        return reverse_lookup(ip_addr)
 
     @staticmethod
     def check_if_valid_cider(cider):
-
-        # is a valid ipv4 cider?
-        if match(r'^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.)'
-                 r'{3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])(\/([0-9]|[1-2][0-9]|3[0-2]))$', cider):
-            return True
-
-        # is a valid ipv6 cider?
-        if match(r'^s*((([0-9A-Fa-f]{1,4}:){7}([0-9A-Fa-f]{1,4}|:))|(([0-9A-Fa-f]{1,4}:){6}(:[0-9A-Fa-f]{1,4}|'
-                 r'((25[0-5]|2[0-4]d|1dd|[1-9]?d)(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3})|:))|(([0-9A-Fa-f]{1,4}:)'
-                 r'{5}(((:[0-9A-Fa-f]{1,4}){1,2})|:((25[0-5]|2[0-4]d|1dd|[1-9]?d)(.(25[0-5]|2[0-4]d|1dd|[1-9]'
-                 r'?d)){3})|:))|(([0-9A-Fa-f]{1,4}:){4}(((:[0-9A-Fa-f]{1,4}){1,3})|((:[0-9A-Fa-f]{1,4})?#'
-                 r'((25[0-5]|2[0-4]d|1dd|[1-9]?d)(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3}))|:))|(([0-9A-Fa-f]{1,4}:)'
-                 r'{3}(((:[0-9A-Fa-f]{1,4}){1,4})|((:[0-9A-Fa-f]{1,4}){0,2}:((25[0-5]|2[0-4]d|1dd|[1-9]?d)'
-                 r'(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3}))|:))|(([0-9A-Fa-f]{1,4}:){2}(((:[0-9A-Fa-f]{1,4}){1,5})|'
-                 r'((:[0-9A-Fa-f]{1,4}){0,3}:((25[0-5]|2[0-4]d|1dd|[1-9]?d)(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3}))|'
-                 r':))|(([0-9A-Fa-f]{1,4}:){1}(((:[0-9A-Fa-f]{1,4}){1,6})|((:[0-9A-Fa-f]{1,4}){0,4}:((25[0-5]|'
-                 r'2[0-4]d|1dd|[1-9]?d)(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3}))|:))|(:(((:[0-9A-Fa-f]{1,4}){1,7})|'
-                 r'((:[0-9A-Fa-f]{1,4}){0,5}:((25[0-5]|2[0-4]d|1dd|[1-9]?d)(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3}))|'
-                 r':)))(%.+)?s*(\/(d|dd|1[0-1]d|12[0-8]))$', cider):
-            return True
-
-        return False
+        return parse_network(cider) is not None
 
     @staticmethod
     def check_if_valid_address(ipaddr):
+        return normalize_address(ipaddr) is not None
+
+    @staticmethod
+    def classify_target(target):
+        """Return (normalized target, 'host' or 'cider'), or (None, None) if the target is neither.
+        Addresses are normalized to their compressed form, keeping an ipv6 zone, and ciders to
+        their network address."""
+
+        if '/' in target:
+            network = parse_network(target)
+
+            if network is not None:
+                return str(network), 'cider'
+
+        else:
+            address = normalize_address(target)
+
+            if address is not None:
+                return address, 'host'
+
+        return None, None
+
+    @staticmethod
+    def validate_targets(targets):
+        """Validate a list of targets in one pass, returns ({normalized target: 'host' or 'cider'}
+        in the order given, without duplicates, [invalid targets])"""
+
+        valid = OrderedDict()
+        invalid = list()
+
+        for target in targets:
+
+            try:
+                normalized, addr_type = Network.classify_target(target)
+            except TypeError:
+                normalized, addr_type = None, None
+
+            if normalized is None:
+                invalid.append(target)
+
+            elif normalized not in valid:
+                valid[normalized] = addr_type
 
-        # is a valid ipv4 address?
-        if match(r'^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.)'
-                 r'{3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$', ipaddr):
-            return True
-
-        # is a valid ipv6 address?
-        elif match(r'^s*((([0-9A-Fa-f]{1,4}:){7}([0-9A-Fa-f]{1,4}|:))|(([0-9A-Fa-f]{1,4}:)'
-                   r'{6}(:[0-9A-Fa-f]{1,4}|((25[0-5]|2[0-4]d|1dd|[1-9]?d)(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3})|:)'
-                   r')|(([0-9A-Fa-f]{1,4}:){5}(((:[0-9A-Fa-f]{1,4}){1,2})|:((25[0-5]|2[0-4]d|1dd|[1-9]?d)'
-                   r'(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3})|:))|(([0-9A-Fa-f]{1,4}:){4}(((:[0-9A-Fa-f]{1,4})'
-                   r'{1,3})|((:[0-9A-Fa-f]{1,4})?:((25[0-5]|2[0-4]d|1dd|[1-9]?d)(.(25[0-5]|2[0-4]d|1dd|[1-9]'
-                   r'?d)){3}))|:))|(([0-9A-Fa-f]{1,4}:){3}(((:[0-9A-Fa-f]{1,4}){1,4})|((:[0-9A-Fa-f]{1,4}){0,2}'
-                   r':((25[0-5]|2[0-4]d|1dd|[1-9]?d)(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3}))|:))|(([0-9A-Fa-f]{1,4}:)'
-                   r'{2}(((:[0-9A-Fa-f]{1,4}){1,5})|((:[0-9A-Fa-f]{1,4}){0,3}:((25[0-5]|2[0-4]d|1dd|[1-9]?d)'
-                   r'(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3}))|:))|(([0-9A-Fa-f]{1,4}:){1}(((:[0-9A-Fa-f]{1,4}){1,6})|'
-                   r'((:[0-9A-Fa-f]{1,4}){0,4}:((25[0-5]|2[0-4]d|1dd|[1-9]?d)(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3}))|'
-                   r':))|(:(((:[0-9A-Fa-f]{1,4}){1,7})|((:[0-9A-Fa-f]{1,4}){0,5}:((25[0-5]|2[0-4]d|1dd|[1-9]?d)'
-                   r'(.(25[0-5]|2[0-4]d|1dd|[1-9]?d)){3}))|:)))(%.+)?s*', ipaddr):
-            return True
-
-        return False
+        return valid, invalid
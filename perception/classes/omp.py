@@ -0,0 +1,263 @@
+import errno
+import socket
+import ssl
+import syslog
+import threading
+from re import match
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+from perception.config import configuration as config
+
+omp_host = 'localhost'
+omp_port = 9390
+
+_sessions = threading.local()
+
+
+class OmpError(Exception):
+    pass
+
+
+class _DeadSession(Exception):
+    """The manager had closed a session before anything of a response arrived, so the command
+    was not run and can be sent again on a new session"""
+    pass
+
+
+def _dead_session_error(e):
+    """True for the errors of writing to or reading from a session the manager closed"""
+
+    if isinstance(e, ssl.SSLError):
+        # a tcp close without a tls close_notify, older pythons report it as a plain SSLError
+        return isinstance(e, getattr(ssl, 'SSLEOFError', ())) or 'eof' in str(e).lower()
+
+    return getattr(e, 'errno', None) in (errno.ECONNRESET, errno.EPIPE)
+
+
+def _send_all(sock, xml):
+
+    try:
+        sock.sendall(xml.encode('utf8'))
+
+    except socket.error as e:
+        if _dead_session_error(e):
+            raise _DeadSession(str(e))
+
+        raise
+
+
+class _ResponseTarget(object):
+    """XMLParser target that only tracks the element depth, so the client knows when the
+    manager has sent a complete response"""
+
+    def __init__(self):
+        self.depth = 0
+        self.done = False
+
+    def start(self, tag, attrib):
+        self.depth += 1
+
+    def end(self, tag):
+        self.depth -= 1
+
+        if self.depth == 0:
+            self.done = True
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class OmpClient(object):
+    def __init__(self, username, password, host=omp_host, port=omp_port, timeout=None):
+        """An authenticated TLS session with the OpenVas Manager, reused for every command"""
+
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.timeout = timeout or getattr(config, 'openvas_omp_timeout', 600)
+        self.sock = None
+
+    def connect(self):
+
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock = context.wrap_socket(sock)
+
+        response = self._send('<authenticate>'
+                              '<credentials>'
+                              '<username>%s</username>'
+                              '<password>%s</password>'
+                              '</credentials>'
+                              '</authenticate>' % (escape(self.username), escape(self.password)))
+
+        status = ET.fromstring(response.encode('utf8')).get('status', '')
+
+        if not status.startswith('2'):
+            self.close()
+            raise OmpError('OpenVas authentication failed for %s: %s' % (self.username, response))
+
+    def close(self):
+
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except (socket.error, ssl.SSLError):
+                pass
+
+        self.sock = None
+
+    def _send(self, xml):
+
+        _send_all(self.sock, xml)
+
+        reader = _SocketReader(self.sock)
+        target = _ResponseTarget()
+        parser = ET.XMLParser(target=target)
+        response = list()
+
+        while not target.done:
+            chunk = reader.read()
+            parser.feed(chunk)
+            response.append(chunk)
+
+        return b''.join(response).decode('utf8', 'ignore')
+
+    def command(self, xml):
+        """Send one command and return the raw response. It is sent again on a new session only
+        when the manager had dropped the idle session before answering, a timeout or a broken
+        response is never resent, so commands that create objects do not run twice."""
+
+        for attempt in (0, 1):
+            reused = self.sock is not None
+
+            try:
+                if not reused:
+                    self.connect()
+
+                return self._send(xml)
+
+            except _DeadSession as e:
+                self.close()
+
+                if attempt or not reused:
+                    raise OmpError('OpenVas Manager error: %s' % str(e))
+
+                syslog.syslog(syslog.LOG_INFO, 'OpenVas info: reconnecting to the manager, %s' % str(e))
+
+            except (socket.error, ssl.SSLError, ET.ParseError) as e:
+                self.close()
+                raise OmpError('OpenVas Manager error: %s' % str(e))
+
+    def iterparse(self, xml, events=('end',)):
+        """Send one command and yield the iterparse events of its response as it arrives, so a
+        large response is never held in memory. Like command, it is sent again only when the
+        manager had dropped the idle session before answering. The session is closed if the
+        response is not read to the end."""
+
+        response_tag = '%s_response' % match(r'\s*<(\w+)', xml).group(1)
+        finished = False
+
+        try:
+            for attempt in (0, 1):
+                reused = self.sock is not None
+
+                try:
+                    if not reused:
+                        self.connect()
+
+                    _send_all(self.sock, xml)
+
+                    for event, elem in ET.iterparse(_SocketReader(self.sock), events):
+                        yield event, elem
+
+                        if event == 'end' and elem.tag == response_tag:
+                            finished = True
+                            return
+
+                except _DeadSession as e:
+                    self.close()
+
+                    if attempt or not reused:
+                        raise OmpError('OpenVas Manager error: %s' % str(e))
+
+                    syslog.syslog(syslog.LOG_INFO, 'OpenVas info: reconnecting to the manager, %s' % str(e))
+
+                except (socket.error, ssl.SSLError, ET.ParseError) as e:
+                    self.close()
+                    raise OmpError('OpenVas Manager error: %s' % str(e))
+
+        finally:
+            if not finished:
+                self.close()
+
+
+class _SocketReader(object):
+    """File-like reader over the session socket for iterparse. The session being closed before
+    the first byte of the response raises _DeadSession, after that it is an error."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.received = False
+
+    def read(self, size=65536):
+
+        try:
+            chunk = self.sock.recv(size)
+
+        except socket.error as e:
+            if not self.received and _dead_session_error(e):
+                raise _DeadSession(str(e))
+
+            raise
+
+        if not chunk:
+            if not self.received:
+                raise _DeadSession('OpenVas Manager closed the connection')
+
+            raise socket.error('OpenVas Manager closed the connection')
+
+        self.received = True
+        return chunk
+
+
+def escape(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def get_client(username, password):
+    """Return this thread's session for the user, creating it the first time"""
+
+    clients = getattr(_sessions, 'clients', None)
+
+    if clients is None:
+        clients = _sessions.clients = dict()
+
+    client = clients.get(username)
+
+    if client is None or client.password != password:
+
+        if client is not None:
+            client.close()
+
+        client = clients[username] = OmpClient(username, password)
+
+    return client
+
+
+def omp(xml, username, password):
+    """Run an OMP command over this thread's session, the replacement for forking omp --xml"""
+    return get_client(username, password).command(xml)
+
+
+def omp_iterparse(xml, username, password, events=('end',)):
+    """Run an OMP command over this thread's session and iterparse the response as it arrives"""
+    return get_client(username, password).iterparse(xml, events)
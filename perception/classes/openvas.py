@@ -2,12 +2,18 @@
 
 import datetime
 import syslog
+import threading
+import hashlib
+from collections import OrderedDict
 from OpenSSL import crypto
 from os import path, makedirs, system
-from subprocess import call, check_output, CalledProcessError, PIPE
+from subprocess import call, check_output, CalledProcessError, Popen, PIPE, STDOUT
 from re import match, search
-from time import sleep
-from perception.classes.xml_output_parser import parse_openvas_xml
+import time
+from perception.classes.xml_output_parser import parse_openvas_xml, store_openvas_vulns, read_openvas_results
+from perception.classes.omp import omp, omp_iterparse, escape
+from perception.classes.network import normalize_address
+from perception.config import configuration as config
 from perception.database.models import OpenvasAdmin, OpenvasLastUpdate
 from perception.shared.functions import get_product_uuid
 from perception import db_session
@@ -21,6 +27,8 @@ servercert_pem = '/var/lib/openvas/CA/servercert.pem'
 clientkey_pem = '/var/lib/openvas/private/CA/clientkey.pem'
 clientcert_pem = '/var/lib/openvas/CA/clientcert.pem'
 system_uuid = get_product_uuid()
+lsc_credential_cache = dict()
+lsc_credential_lock = threading.Lock()
 
 
 def setup_openvas():
@@ -142,32 +150,144 @@ def verify_certificate_chain(cert_str, trusted_certs):
     return True
 
 
+class ScanGate(object):
+    def __init__(self):
+        """Lets OpenVas scans through while the manager is up. pause() holds back new scans and
+        waits for the running ones to finish, resume() lets the held scans continue."""
+
+        self.cond = threading.Condition()
+        self.paused = False
+        self.running = 0
+
+    def enter(self):
+
+        with self.cond:
+            while self.paused:
+                self.cond.wait()
+
+            self.running += 1
+
+    def leave(self):
+
+        with self.cond:
+            self.running -= 1
+            self.cond.notify_all()
+
+    def pause(self, timeout):
+        """Returns True once no scan is running, False if scans were still running after timeout seconds"""
+
+        deadline = time.time() + timeout
+
+        with self.cond:
+            self.paused = True
+
+            while self.running > 0 and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+
+            return self.running == 0
+
+    def resume(self):
+
+        with self.cond:
+            self.paused = False
+            self.cond.notify_all()
+
+
+scan_gate = ScanGate()
+
+feed_syncs = (('greenbone-nvt-sync', 'NVT'),
+              ('greenbone-scapdata-sync', 'Scap Data'),
+              ('greenbone-certdata-sync', 'Cert Data'))
+
+
+class FeedSync(object):
+    def __init__(self, command, feed):
+        """Run a greenbone feed sync, keeping count of its output lines for progress reports"""
+
+        self.command = command
+        self.feed = feed
+        self.lines = 0
+        self.last_line = ''
+        self.started = time.time()
+        self.process = Popen([command], stdout=PIPE, stderr=STDOUT)
+
+        self.reader = threading.Thread(target=self.read)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def read(self):
+
+        for line in iter(self.process.stdout.readline, b''):
+            self.lines += 1
+            self.last_line = line.decode('utf8', 'ignore').strip()
+
+    def poll(self):
+        return self.process.poll()
+
+    def progress(self):
+        return 'OpenVas sync info: %s running for %ds, %d lines, %s' % (self.command,
+                                                                      time.time() - self.started,
+                                                                      self.lines,
+                                                                      self.last_line)
+
+
 def update_openvas_db():
-    greenbone_nvt_sync = call(['greenbone-nvt-sync'])
+    """Run the NVT, SCAP and CERT feed syncs one after the other, or at the same time when
+    openvas_parallel_sync is set, logging their progress every openvas_sync_progress seconds.
+    The community feed rate limits concurrent rsyncs, so only a private feed should sync in parallel."""
 
-    if greenbone_nvt_sync == 0:
-        greenbone_scapdata_sync = call(['greenbone-scapdata-sync'])
+    progress_interval = getattr(config, 'openvas_sync_progress', 60)
 
-        if greenbone_scapdata_sync == 0:
-            greenbone_certdata_sync = call(['greenbone-certdata-sync'])
+    if getattr(config, 'openvas_parallel_sync', False):
+        stages = [feed_syncs]
+    else:
+        stages = [[feed_sync] for feed_sync in feed_syncs]
 
-            if greenbone_certdata_sync == 0:
-                return 0
+    for stage in stages:
+        syncs = [FeedSync(command, feed) for command, feed in stage]
+        last_progress = time.time()
 
-            elif greenbone_certdata_sync != 0:
-                syslog.syslog(syslog.LOG_INFO, 'Failed tp sync OpenVas Cert Data')
-                return 99
+        while [sync for sync in syncs if sync.poll() is None]:
+            time.sleep(1)
+
+            if time.time() - last_progress >= progress_interval:
+                last_progress = time.time()
+
+                for sync in syncs:
+                    if sync.poll() is None:
+                        syslog.syslog(syslog.LOG_INFO, sync.progress())
 
-        elif greenbone_scapdata_sync != 0:
-            syslog.syslog(syslog.LOG_INFO, 'Failed to sync OpenVas Scap Data')
+        failed = [sync for sync in syncs if sync.poll() != 0]
+
+        for sync in failed:
+            syslog.syslog(syslog.LOG_INFO, 'Failed to sync OpenVas %s' % sync.feed)
+
+        if failed:
             return 99
 
-    elif greenbone_nvt_sync != 0:
-        syslog.syslog(syslog.LOG_INFO, 'Failed to sync OpenVas NVT')
-        return 99
+    return 0
 
 
 def migrate_rebuild_db():
+    """Rebuild the OpenVas database once the running scans are done, new scans wait until the
+    manager is back up. Stopping the manager would kill the running scans, so if they are not
+    done within openvas_rebuild_drain seconds the rebuild is put off and 99 is returned."""
+
+    drain = getattr(config, 'openvas_rebuild_drain', 10*60)
+
+    try:
+        if not scan_gate.pause(drain):
+            syslog.syslog(syslog.LOG_INFO, 'OpenVas info: scans still running after %ds, postponing the rebuild'
+                          % drain)
+            return 99
+
+        return stop_migrate_rebuild_db()
+
+    finally:
+        scan_gate.resume()
+
+
+def stop_migrate_rebuild_db():
     # stop services and migrate database
     stop_manager = call(['service', 'openvas-manager', 'stop'])
 
@@ -185,7 +305,7 @@ def migrate_rebuild_db():
 
                     if openvasmd_rebuild == 0:
                         killall_openvas = call(['killall', 'openvassd'])
-                        sleep(15)
+                        time.sleep(15)
 
                         if killall_openvas == 0:
                             start_openvas_scanner = call(['systemctl', 'start', 'openvas-scanner'])
@@ -235,12 +355,7 @@ def get_info(info_type, filter_term, openvas_user_username, openvas_user_passwor
                    ' filter=\'%s rows=-1\'>' \
                    '</get_info>' % (info_type, filter_term)
 
-    get_info_response = check_output(['omp',
-                                      '--port=9390',
-                                      '--host=localhost',
-                                      '--username=%s' % openvas_user_username,
-                                      '--password=%s' % openvas_user_password,
-                                      '--xml=%s' % get_info_cli]).decode('utf8', 'ignore')
+    get_info_response = omp(get_info_cli, openvas_user_username, openvas_user_password)
 
     error = search(r'status=\"503\"', get_info_response)
 
@@ -259,12 +374,7 @@ def create_config(config_name, openvas_user_username, openvas_user_password):
                         '<name>%s</name>' \
                         '</create_config>' % config_name
 
-    create_config_response = check_output(['omp',
-                                           '--port=9390',
-                                           '--host=localhost',
-                                           '--username=%s' % openvas_user_username,
-                                           '--password=%s' % openvas_user_password,
-                                           '--xml=%s' % create_config_cli]).decode()
+    create_config_response = omp(create_config_cli, openvas_user_username, openvas_user_password)
 
     error = search(r'status=\"503\"', create_config_response)
 
@@ -287,12 +397,7 @@ def modify_config(config_id, openvas_user_username, openvas_user_password, nvt_f
                         '</nvt_selection>' \
                         '</modify_config>' % (config_id, nvt_family, nvt_oids)
 
-    modify_config_response = check_output(['omp',
-                                           '--port=9390',
-                                           '--host=localhost',
-                                           '--username=%s' % openvas_user_username,
-                                           '--password=%s' % openvas_user_password,
-                                           '--xml=%s' % modify_config_cli]).decode()
+    modify_config_response = omp(modify_config_cli, openvas_user_username, openvas_user_password)
 
     error = search(r'status=\"503\"', modify_config_response)
     success = search(r'status=\"200\"', modify_config_response)
@@ -318,12 +423,7 @@ def create_port_list(port_list_name, openvas_user_username, openvas_user_passwor
                            '<port_range>%s:%s</port_range>' \
                            '</create_port_list>' % (port_list_name, pro, ','.join(port_list))
 
-    create_port_list_response = check_output(['omp',
-                                              '--port=9390',
-                                              '--host=localhost',
-                                              '--username=%s' % openvas_user_username,
-                                              '--password=%s' % openvas_user_password,
-                                              '--xml=%s' % create_port_list_cli]).decode()
+    create_port_list_response = omp(create_port_list_cli, openvas_user_username, openvas_user_password)
 
     error = search(r'status=\"503\"', create_port_list_response)
 
@@ -337,6 +437,54 @@ def create_port_list(port_list_name, openvas_user_username, openvas_user_passwor
         return create_port_list_response_id.group(0)
 
 
+def find_port_list(port_list_name, openvas_user_username, openvas_user_password):
+    get_port_lists_cli = '<get_port_lists filter=\'name="%s" rows=1\'/>' % port_list_name
+    get_port_lists_response = omp(get_port_lists_cli, openvas_user_username, openvas_user_password)
+
+    port_list_id = search(r'<port_list id="([\w-]+)"', get_port_lists_response)
+
+    if port_list_id:
+        return port_list_id.group(1)
+
+
+def find_target(targets_name, openvas_user_username, openvas_user_password):
+    get_targets_cli = '<get_targets filter=\'name="%s" rows=1\'/>' % targets_name
+    get_targets_response = omp(get_targets_cli, openvas_user_username, openvas_user_password)
+
+    target_id = search(r'<target id="([\w-]+)"', get_targets_response)
+
+    if target_id:
+        return target_id.group(1)
+
+
+def list_port_lists(name_prefix, openvas_user_username, openvas_user_password):
+    """[(name, id)] of every port list whose name starts with name_prefix"""
+
+    get_port_lists_cli = '<get_port_lists filter=\'name~"%s" rows=-1\'/>' % escape(name_prefix)
+    get_port_lists_response = omp(get_port_lists_cli, openvas_user_username, openvas_user_password)
+
+    port_lists = parse_openvas_xml(get_port_lists_response)
+
+    if isinstance(port_lists, list):
+        return [(name, port_list_id) for name, port_list_id in port_lists if (name or '').startswith(name_prefix)]
+
+    return []
+
+
+def list_targets(name_prefix, openvas_user_username, openvas_user_password):
+    """[(name, id, port list name)] of every target whose name starts with name_prefix"""
+
+    get_targets_cli = '<get_targets filter=\'name~"%s" rows=-1\'/>' % escape(name_prefix)
+    get_targets_response = omp(get_targets_cli, openvas_user_username, openvas_user_password)
+
+    targets = parse_openvas_xml(get_targets_response)
+
+    if isinstance(targets, list):
+        return [target for target in targets if (target[0] or '').startswith(name_prefix)]
+
+    return []
+
+
 def create_target(targets_name, openvas_user_username, openvas_user_password, host_ip, port_list_id):
     create_target_cli = '<create_target>' \
                         '<name>%s</name>' \
@@ -344,12 +492,7 @@ def create_target(targets_name, openvas_user_username, openvas_user_password, ho
                         '<port_list id=\'%s\'/>' \
                         '</create_target>' % (targets_name, host_ip, port_list_id)
 
-    create_target_response = check_output(['omp',
-                                           '--port=9390',
-                                           '--host=localhost',
-                                           '--username=%s' % openvas_user_username,
-                                           '--password=%s' % openvas_user_password,
-                                           '--xml=%s' % create_target_cli]).decode()
+    create_target_response = omp(create_target_cli, openvas_user_username, openvas_user_password)
 
     error = search(r'status=\"503\"', create_target_response)
 
@@ -363,42 +506,46 @@ def create_target(targets_name, openvas_user_username, openvas_user_password, ho
         return create_target_response_id.group(0)
 
 
-def create_targets_with_smb_lsc(targets_name, openvas_user_username, openvas_user_password, lsc_id, smb_scan_list):
+def create_lsc_target(targets_name, openvas_user_username, openvas_user_password, lsc_type, lsc_id, scan_list,
+                      port_list_id=None):
+    """Create a target that logs in to its hosts with the ssh or smb credential lsc_id"""
+
+    if port_list_id is not None:
+        port_list_xml = '<port_list id=\'%s\'/>' % port_list_id
+    else:
+        port_list_xml = ''
+
     create_target_cli = '<create_target>' \
                         '<name>%s</name>' \
                         '<hosts>%s</hosts>' \
-                        '<smb_lsc_credential id="%s"/>' \
-                        '</create_target>' % (targets_name, ', '.join(smb_scan_list), lsc_id)
+                        '%s' \
+                        '<%s_lsc_credential id="%s"/>' \
+                        '</create_target>' % (targets_name, ', '.join(scan_list), port_list_xml, lsc_type, lsc_id)
 
-    create_target_response = check_output(['omp',
-                                           '--port=9390',
-                                           '--host=localhost',
-                                           '--username=%s' % openvas_user_username,
-                                           '--password=%s' % openvas_user_password,
-                                           '--xml=%s' % create_target_cli]).decode()
+    create_target_response = omp(create_target_cli, openvas_user_username, openvas_user_password)
 
-    create_target_response_id = search(r'\w+[-]\w+[-]\w+[-]\w+[-]\w+', create_target_response).group(0)
+    error = search(r'status=\"[45]\d\d\"', create_target_response)
 
-    return create_target_response_id
+    if error:
+        syslog.syslog(syslog.LOG_INFO, str('OpenVas error: %s' % create_target_response))
+        return
 
+    create_target_response_id = search(r'\w+[-]\w+[-]\w+[-]\w+[-]\w+', create_target_response)
+
+    if create_target_response_id:
+        return create_target_response_id.group(0)
 
-def create_targets_with_ssh_lsc(targets_name, openvas_user_username, openvas_user_password, lsc_id, ssh_scan_list):
-    create_target_cli = '<create_target>' \
-                        '<name>%s</name>' \
-                        '<hosts>%s</hosts>' \
-                        '<ssh_lsc_credential id="%s"/>' \
-                        '</create_target>' % (targets_name, ', '.join(ssh_scan_list), lsc_id)
 
-    create_target_response = check_output(['omp',
-                                           '--port=9390',
-                                           '--host=localhost',
-                                           '--username=%s' % openvas_user_username,
-                                           '--password=%s' % openvas_user_password,
-                                           '--xml=%s' % create_target_cli]).decode()
+def create_targets_with_smb_lsc(targets_name, openvas_user_username, openvas_user_password, lsc_id, smb_scan_list,
+                                port_list_id=None):
+    return create_lsc_target(targets_name, openvas_user_username, openvas_user_password, 'smb', lsc_id,
+                             smb_scan_list, port_list_id)
 
-    create_target_response_id = search(r'\w+[-]\w+[-]\w+[-]\w+[-]\w+', create_target_response).group(0)
 
-    return create_target_response_id
+def create_targets_with_ssh_lsc(targets_name, openvas_user_username, openvas_user_password, lsc_id, ssh_scan_list,
+                                port_list_id=None):
+    return create_lsc_target(targets_name, openvas_user_username, openvas_user_password, 'ssh', lsc_id,
+                             ssh_scan_list, port_list_id)
 
 
 def create_task(task_name, target_id, config_id, openvas_user_username, openvas_user_password):
@@ -409,12 +556,7 @@ def create_task(task_name, target_id, config_id, openvas_user_username, openvas_
                       '<target id=\'%s\'/>' \
                       '</create_task>' % (task_name, config_id, target_id)
 
-    create_task_response = check_output(['omp',
-                                         '--port=9390',
-                                         '--host=localhost',
-                                         '--username=%s' % openvas_user_username,
-                                         '--password=%s' % openvas_user_password,
-                                         '--xml=%s' % create_task_cli]).decode()
+    create_task_response = omp(create_task_cli, openvas_user_username, openvas_user_password)
 
     error = search(r'status=\"503\"', create_task_response)
 
@@ -436,14 +578,9 @@ def create_lsc_credential(name, login, password, openvas_user_username, openvas_
                                 '<login>%s</login>' \
                                 '<password>%s</password>' \
                                 '<comment></comment>' \
-                                '</create_lsc_credential>' % (name, login, password)
+                                '</create_lsc_credential>' % (escape(name), escape(login), escape(password))
 
-    create_lsc_credential_cli_response = check_output(['omp',
-                                                       '--port=9390',
-                                                       '--host=localhost',
-                                                       '--username=%s' % openvas_user_username,
-                                                       '--password=%s' % openvas_user_password,
-                                                       '--xml=%s' % create_lsc_credential_cli]).decode()
+    create_lsc_credential_cli_response = omp(create_lsc_credential_cli, openvas_user_username, openvas_user_password)
 
     return parse_openvas_xml(create_lsc_credential_cli_response)
 
@@ -451,25 +588,69 @@ def create_lsc_credential(name, login, password, openvas_user_username, openvas_
 def get_lsc_crdentials(openvas_user_username, openvas_user_password):
     get_lsc_credential_cli = '<get_lsc_credentials/>'
 
-    get_lsc_credential_cli_response = check_output(['omp',
-                                                    '--port=9390',
-                                                    '--host=localhost',
-                                                    '--username=%s' % openvas_user_username,
-                                                    '--password=%s' % openvas_user_password,
-                                                    '--xml=%s' % get_lsc_credential_cli]).decode()
+    get_lsc_credential_cli_response = omp(get_lsc_credential_cli, openvas_user_username, openvas_user_password)
 
     return parse_openvas_xml(get_lsc_credential_cli_response)
 
 
+def lsc_credential(lsc_type, login, password, openvas_user_username, openvas_user_password):
+    """Id of the OpenVas credential for an ssh or smb login, looked up or created once per process.
+    The credential is named after a hash of the login and password, so a changed password gets a
+    new credential."""
+
+    key = hashlib.sha1(('%s|%s|%s' % (lsc_type, login, password)).encode('utf8')).hexdigest()[:20]
+    name = 'perception %s %s' % (lsc_type, key)
+
+    with lsc_credential_lock:
+        lsc_id = lsc_credential_cache.get((openvas_user_username, name))
+
+        if lsc_id is not None:
+            return lsc_id
+
+        lsc_id = dict(get_lsc_crdentials(openvas_user_username, openvas_user_password) or []).get(name)
+
+        if lsc_id is None:
+            response = create_lsc_credential(name, login, password, openvas_user_username, openvas_user_password)
+
+            if not response or not match(r'\w+[-]\w+[-]\w+[-]\w+[-]\w+$', response):
+                syslog.syslog(syslog.LOG_INFO, 'OpenVas error: could not create the %s credential for %s: %s'
+                              % (lsc_type, login, str(response)))
+                return
+
+            lsc_id = response
+
+        lsc_credential_cache[(openvas_user_username, name)] = lsc_id
+
+    return lsc_id
+
+
+def lsc_credentials(openvas_user_username, openvas_user_password):
+    """{'ssh': id, 'smb': id} of the scan credentials set in the configuration"""
+
+    credentials = dict()
+
+    for lsc_type in ('ssh', 'smb'):
+        login = getattr(config, 'openvas_%s_login' % lsc_type, None)
+
+        if not login:
+            continue
+
+        lsc_id = lsc_credential(lsc_type,
+                                login,
+                                getattr(config, 'openvas_%s_password' % lsc_type, ''),
+                                openvas_user_username,
+                                openvas_user_password)
+
+        if lsc_id is not None:
+            credentials[lsc_type] = lsc_id
+
+    return credentials
+
+
 def start_task(task_id, openvas_user_username, openvas_user_password):
 
     start_task_cli = '<start_task task_id="%s"/>' % task_id
-    start_task_response = check_output(['omp',
-                                        '--port=9390',
-                                        '--host=localhost',
-                                        '--username=%s' % openvas_user_username,
-                                        '--password=%s' % openvas_user_password,
-                                        '--xml=%s' % start_task_cli]).decode()
+    start_task_response = omp(start_task_cli, openvas_user_username, openvas_user_password)
 
     error = search(r'status=\"503\"', start_task_response)
 
@@ -485,81 +666,81 @@ def start_task(task_id, openvas_user_username, openvas_user_password):
 
 def check_task(task_id, openvas_user_username, openvas_user_password):
     get_task_cli = '<get_tasks task_id="%s"/>' % task_id
-    get_task_cli_response = check_output(['omp',
-                                          '--port=9390',
-                                          '--host=localhost',
-                                          '--username=%s' % openvas_user_username,
-                                          '--password=%s' % openvas_user_password,
-                                          '--xml=%s' % get_task_cli]).decode()
+    get_task_cli_response = omp(get_task_cli, openvas_user_username, openvas_user_password)
 
     return parse_openvas_xml(get_task_cli_response)
 
 
-def get_report(report_id, openvas_user_username, openvas_user_password):
-    get_report_cli = '<get_reports report_id="%s"/>' % report_id
-    get_report_cli_response = check_output(['omp',
-                                            '--port=9390',
-                                            '--host=localhost',
-                                            '--username=%s' % openvas_user_username,
-                                            '--password=%s' % openvas_user_password,
-                                            '--xml=%s' % get_report_cli]).decode()
+def get_task_statuses(openvas_user_username, openvas_user_password):
+    get_tasks_cli = '<get_tasks filter="rows=-1"/>'
+    get_tasks_cli_response = omp(get_tasks_cli, openvas_user_username, openvas_user_password)
+
+    return parse_openvas_xml(get_tasks_cli_response, 'task_statuses')
+
+
+def get_report(report_id, openvas_user_username, openvas_user_password, hosts=()):
+    """Fetch the results with a severity above 0 one page at a time, each page is parsed as
+    it is read, then store the vulnerabilities of every host in the report. hosts are the scanned
+    hosts, they are stored even without results so their fixed vulnerabilities are closed."""
+
+    rows = getattr(config, 'openvas_report_rows', 500)
+    host_vulns = OrderedDict((normalize_address(host) or host, list()) for host in hosts)
+    first = 1
+
+    while True:
+        get_report_cli = '<get_reports report_id="%s"' \
+                         ' filter="severity&gt;0 apply_overrides=1 min_qod=0 first=%d rows=%d"' \
+                         ' details="1"/>' % (report_id, first, rows)
+
+        status, results = read_openvas_results(omp_iterparse(get_report_cli,
+                                                             openvas_user_username,
+                                                             openvas_user_password),
+                                               host_vulns)
+
+        if status is None or not status.startswith('2'):
+            syslog.syslog(syslog.LOG_INFO, 'OpenVas error: get_reports %s returned status %s' % (report_id, status))
+            return 99
+
+        if results < rows:
+            break
+
+        first += rows
+
+    # nothing was scanned and nothing was found, there is nothing to store
+    if not host_vulns:
+        return 0
 
-    parse_openvas_xml(get_report_cli_response)
+    return store_openvas_vulns(host_vulns, report_id)
 
 
 def delete_task(task_id, openvas_user_username, openvas_user_password):
     delete_task_cli = '<delete_task task_id="%s"/>' % task_id
-    delete_task_cli_response = check_output(['omp',
-                                             '--port=9390',
-                                             '--host=localhost',
-                                             '--username=%s' % openvas_user_username,
-                                             '--password=%s' % openvas_user_password,
-                                             '--xml=%s' % delete_task_cli]).decode()
+    delete_task_cli_response = omp(delete_task_cli, openvas_user_username, openvas_user_password)
 
     return delete_task_cli_response
 
 
 def delete_targets(target_id, openvas_user_username, openvas_user_password):
     delete_targets_cli = '<delete_target target_id="%s"/>' % target_id
-    delete_targets_cli_response = check_output(['omp',
-                                                '--port=9390',
-                                                '--host=localhost',
-                                                '--username=%s' % openvas_user_username,
-                                                '--password=%s' % openvas_user_password,
-                                                '--xml=%s' % delete_targets_cli]).decode()
+    delete_targets_cli_response = omp(delete_targets_cli, openvas_user_username, openvas_user_password)
 
     return delete_targets_cli_response
 
 
 def delete_port_list(port_list_id, openvas_user_username, openvas_user_password):
     delete_port_list_cli = '<delete_port_list port_list_id="%s"/>' % port_list_id
-    delete_port_list_cli_response = check_output(['omp',
-                                                  '--port=9390',
-                                                  '--host=localhost',
-                                                  '--username=%s' % openvas_user_username,
-                                                  '--password=%s' % openvas_user_password,
-                                                  '--xml=%s' % delete_port_list_cli]).decode()
+    delete_port_list_cli_response = omp(delete_port_list_cli, openvas_user_username, openvas_user_password)
 
     return delete_port_list_cli_response
 
 
 def delete_reports(report_id, openvas_user_username, openvas_user_password):
     delete_report_cli = '<delete_report report_id="%s"/>' % report_id
-    delete_report_cli_response = check_output(['omp',
-                                               '--port=9390',
-                                               '--host=localhost',
-                                               '--username=%s' % openvas_user_username,
-                                               '--password=%s' % openvas_user_password,
-                                               '--xml=%s' % delete_report_cli]).decode()
+    delete_report_cli_response = omp(delete_report_cli, openvas_user_username, openvas_user_password)
     return delete_report_cli_response
 
 
 def delete_config(config_id,openvas_user_username, openvas_user_password):
     delete_config_cli = '<delete_config config_id="%s"/>' % config_id
-    delete_config_cli_response = check_output(['omp',
-                                               '--port=9390',
-                                               '--host=localhost',
-                                               '--username=%s' % openvas_user_username,
-                                               '--password=%s' % openvas_user_password,
-                                               '--xml=%s' % delete_config_cli]).decode()
+    delete_config_cli_response = omp(delete_config_cli, openvas_user_username, openvas_user_password)
     return delete_config_cli_response
@@ -0,0 +1,338 @@
+import random
+import select
+import socket
+import struct
+import syslog
+import threading
+import time
+from binascii import hexlify
+from collections import OrderedDict
+from perception.config import configuration as config
+
+resolv_conf = '/etc/resolv.conf'
+
+PTR = 12
+NXDOMAIN = 3
+
+
+def system_nameservers(conf=resolv_conf):
+    """Every nameserver in resolv.conf, in order"""
+
+    nameservers = list()
+
+    try:
+        with open(conf) as f:
+            for line in f:
+                fields = line.split()
+
+                if len(fields) > 1 and fields[0] == 'nameserver':
+                    nameservers.append(fields[1])
+
+    except (IOError, OSError):
+        pass
+
+    return nameservers
+
+
+def ptr_name(ip_addr):
+    """The in-addr.arpa or ip6.arpa name of an address, raises ValueError for anything else"""
+
+    try:
+        if ':' in ip_addr:
+            nibbles = hexlify(socket.inet_pton(socket.AF_INET6, ip_addr)).decode('ascii')
+            return '.'.join(reversed(nibbles)) + '.ip6.arpa'
+
+        socket.inet_pton(socket.AF_INET, ip_addr)
+
+    except (socket.error, TypeError):
+        raise ValueError('not an ip address: %s' % str(ip_addr))
+
+    return '.'.join(reversed(ip_addr.split('.'))) + '.in-addr.arpa'
+
+
+def build_query(query_id, name):
+    """A recursive PTR query for name"""
+
+    labels = b''.join(struct.pack('B', len(label)) + label.encode('ascii') for label in name.split('.'))
+
+    return struct.pack('>HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + labels + b'\0' + struct.pack('>HH', PTR, 1)
+
+
+def read_name(msg, offset):
+    """Read a possibly compressed name at offset of a bytearray message, returns (name, next offset)"""
+
+    labels = list()
+    end = None
+    jumps = 0
+
+    while True:
+        length = msg[offset]
+
+        if length & 0xc0 == 0xc0:
+            jumps += 1
+
+            if jumps > 32:
+                raise ValueError('name compression loop')
+
+            if end is None:
+                end = offset + 2
+
+            offset = ((length & 0x3f) << 8) | msg[offset + 1]
+            continue
+
+        offset += 1
+
+        if length == 0:
+            break
+
+        labels.append(msg[offset:offset + length].decode('ascii', 'replace'))
+        offset += length
+
+    return '.'.join(labels), end if end is not None else offset
+
+
+def parse_response(data):
+    """Return (query id, question name, rcode, hostname, ttl) of a PTR response, hostname and ttl
+    are None when there is no PTR record"""
+
+    msg = bytearray(data)
+    query_id, flags, qdcount, ancount = struct.unpack_from('>HHHH', data, 0)
+
+    offset = 12
+    question = None
+
+    for i in range(qdcount):
+        name, offset = read_name(msg, offset)
+        offset += 4
+
+        if question is None:
+            question = name
+
+    for i in range(ancount):
+        name, offset = read_name(msg, offset)
+        rtype, rclass, ttl, rdlength = struct.unpack_from('>HHIH', data, offset)
+        offset += 10
+
+        if rtype == PTR:
+            return query_id, question, flags & 0xf, read_name(msg, offset)[0], ttl
+
+        offset += rdlength
+
+    return query_id, question, flags & 0xf, None, None
+
+
+class ReverseResolver(object):
+    def __init__(self, nameservers=None, port=53, timeout=2, retries=1, ttl=3600, negative_ttl=300,
+                 concurrency=64, size=10000):
+        """Reverse DNS lookups with a cache. Addresses are looked up in batches, the PTR queries of a
+        batch are sent from one socket, at most concurrency at a time, and each is waited on for
+        timeout seconds and retried retries times. The nameservers are asked in order, the next one
+        only for the addresses the one before did not answer. Addresses still without a name go to
+        the system resolver, gethostbyaddr from threads, so /etc/hosts and nsswitch are honored.
+        Names are kept for their record's ttl, at most ttl seconds, and addresses without a name,
+        including ones that timed out, for negative_ttl seconds."""
+
+        if isinstance(nameservers, str):
+            nameservers = [nameservers]
+
+        self.nameservers = list(nameservers or ())
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.concurrency = max(1, concurrency)
+        self.size = size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, ip_addr):
+        """Return the hostname of an address, or None"""
+        return self.lookup_many([ip_addr]).get(ip_addr)
+
+    def lookup_many(self, ip_addrs):
+        """Return {address: hostname or None} for the addresses"""
+
+        now = time.time()
+        results = dict()
+        missing = list()
+
+        with self.lock:
+            for ip_addr in set(ip_addrs):
+                entry = self.cache.get(ip_addr)
+
+                if entry is not None and entry[1] > now:
+                    results[ip_addr] = entry[0]
+                else:
+                    missing.append(ip_addr)
+
+        if not missing:
+            return results
+
+        answers = dict()
+
+        for nameserver in self.nameservers:
+            unanswered = [ip_addr for ip_addr in missing if ip_addr not in answers]
+
+            if not unanswered:
+                break
+
+            answers.update(self.query(unanswered, nameserver))
+
+        # misses and failures of the nameservers get one more try through the system resolver
+        unnamed = [ip_addr for ip_addr in missing if not answers.get(ip_addr, (None, None))[0]]
+
+        if unnamed:
+            answers.update((ip_addr, answer) for ip_addr, answer in self.system_query(unnamed).items()
+                           if answer[0] or ip_addr not in answers)
+
+        with self.lock:
+            for ip_addr in missing:
+                hostname, ttl = answers.get(ip_addr, (None, None))
+
+                if hostname:
+                    expires = now + min(ttl if ttl is not None else self.ttl, self.ttl)
+                else:
+                    expires = now + self.negative_ttl
+
+                self.cache.pop(ip_addr, None)
+                self.cache[ip_addr] = (hostname, expires)
+                results[ip_addr] = hostname
+
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+        return results
+
+    def query(self, ip_addrs, nameserver):
+        """Ask the nameserver for the PTR record of each address, returns {address: (hostname, ttl)}
+        for the ones that were answered"""
+
+        answers = dict()
+        names = dict()
+
+        for ip_addr in ip_addrs:
+            try:
+                names[ip_addr] = ptr_name(ip_addr)
+            except ValueError:
+                answers[ip_addr] = (None, None)
+
+        family = socket.AF_INET6 if ':' in nameserver else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+
+        try:
+            for attempt in range(self.retries + 1):
+                waiting = [ip_addr for ip_addr in names if ip_addr not in answers]
+
+                for i in range(0, len(waiting), self.concurrency):
+                    self.query_window(sock, nameserver, waiting[i:i + self.concurrency], names, answers)
+
+        except socket.error as dns_e:
+            syslog.syslog(syslog.LOG_INFO, 'ReverseResolver error: %s %s' % (nameserver, str(dns_e)))
+
+        finally:
+            sock.close()
+
+        return answers
+
+    def query_window(self, sock, nameserver, ip_addrs, names, answers):
+        """Send one query per address and read answers until all arrive or timeout passes"""
+
+        pending = dict()
+
+        for ip_addr in ip_addrs:
+            query_id = random.getrandbits(16)
+
+            while query_id in pending:
+                query_id = random.getrandbits(16)
+
+            pending[query_id] = ip_addr
+            sock.sendto(build_query(query_id, names[ip_addr]), (nameserver, self.port))
+
+        deadline = time.time() + self.timeout
+
+        while pending:
+            remaining = deadline - time.time()
+
+            if remaining <= 0:
+                break
+
+            readable = select.select([sock], [], [], remaining)[0]
+
+            if not readable:
+                break
+
+            data = sock.recv(4096)
+
+            try:
+                query_id, question, rcode, hostname, ttl = parse_response(data)
+            except (ValueError, IndexError, struct.error):
+                continue
+
+            ip_addr = pending.get(query_id)
+
+            # ignore late answers to an earlier try and answers to someone else's question
+            if ip_addr is None or (question or '').lower() != names[ip_addr]:
+                continue
+
+            del pending[query_id]
+
+            if hostname or rcode in (0, NXDOMAIN):
+                answers[ip_addr] = (hostname, ttl)
+
+    def system_query(self, ip_addrs):
+        """gethostbyaddr each address on its own thread, concurrency at a time, waiting at most
+        timeout seconds on each group"""
+
+        answers = dict()
+
+        def resolve(ip_addr):
+            try:
+                # gethostbyaddr also takes host names, only addresses are looked up
+                ptr_name(ip_addr)
+                answers[ip_addr] = (socket.gethostbyaddr(ip_addr)[0], None)
+            except (socket.herror, socket.gaierror, socket.error, TypeError, ValueError):
+                answers[ip_addr] = (None, None)
+
+        for i in range(0, len(ip_addrs), self.concurrency):
+            threads = list()
+
+            for ip_addr in ip_addrs[i:i + self.concurrency]:
+                t = threading.Thread(target=resolve, args=(ip_addr,))
+                t.daemon = True
+                t.start()
+                threads.append(t)
+
+            deadline = time.time() + self.timeout * (self.retries + 1)
+
+            for t in threads:
+                t.join(max(0, deadline - time.time()))
+
+        return dict(answers)
+
+
+resolver = None
+resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """The reverse DNS resolver shared by every thread in this process"""
+
+    global resolver
+
+    with resolver_lock:
+        if resolver is None:
+            resolver = ReverseResolver(getattr(config, 'dns_nameserver', None) or system_nameservers(),
+                                       getattr(config, 'dns_port', 53),
+                                       getattr(config, 'dns_timeout', 2),
+                                       getattr(config, 'dns_retries', 1),
+                                       getattr(config, 'dns_cache_ttl', 3600),
+                                       getattr(config, 'dns_negative_ttl', 300),
+                                       getattr(config, 'dns_concurrency', 64))
+
+    return resolver
+
+
+def reverse_lookup(ip_addr):
+    """The hostname of an address through the shared resolver, or None"""
+    return get_resolver().lookup(ip_addr)
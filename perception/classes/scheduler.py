@@ -0,0 +1,116 @@
+from perception.classes.workers import WorkerPool
+from hashlib import sha1
+from random import uniform
+from time import time, sleep
+import threading
+import syslog
+
+
+class Job(object):
+    def __init__(self, name, func, interval, priority=5, jitter=0.1):
+        """A recurring job, lower priority numbers run first when jobs compete for a slot"""
+
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.priority = priority
+        self.jitter = jitter
+        self.running = False
+        self.last_completed = None
+
+        # spread the first runs so jobs added together do not all start at once
+        self.next_due = time() + uniform(0, jitter * interval)
+
+    def reschedule(self):
+        self.last_completed = time()
+        self.next_due = self.last_completed + self.interval * (1 + uniform(-self.jitter, self.jitter))
+
+
+class Scheduler(object):
+    def __init__(self, max_concurrency=3, tick=1):
+        """Run recurring jobs when they are due, never more than max_concurrency at once
+        and never two runs of the same job at once"""
+
+        self.max_concurrency = max_concurrency
+        self.tick = tick
+        self.jobs = list()
+        self.lock = threading.Lock()
+        self.pool = WorkerPool('Scheduler', max_concurrency)
+
+        t = threading.Thread(target=self.run, args=())
+        t.start()
+
+    def add_job(self, name, func, interval, priority=5, jitter=0.1):
+        job = Job(name, func, interval, priority, jitter)
+
+        with self.lock:
+            self.jobs.append(job)
+
+        return job
+
+    def execute(self, job):
+
+        try:
+            job.func()
+
+        except Exception as job_e:
+            syslog.syslog(syslog.LOG_INFO, 'Scheduler error: %s failed: %s' % (job.name, str(job_e)))
+
+        finally:
+            with self.lock:
+                job.reschedule()
+                job.running = False
+
+    def run(self):
+
+        while True:
+            now = time()
+
+            with self.lock:
+                running = len([j for j in self.jobs if j.running])
+                due = sorted([j for j in self.jobs if not j.running and j.next_due <= now],
+                             key=lambda j: (j.priority, j.next_due))
+
+                for job in due[:max(self.max_concurrency - running, 0)]:
+                    job.running = True
+                    self.pool.submit(self.execute, job)
+
+            sleep(self.tick)
+
+
+class DueTracker(object):
+    def __init__(self, interval, jitter=0.1):
+        """Track next due times per key (ie. per device) from the last time each one completed"""
+
+        self.interval = interval
+        self.jitter = jitter
+        self.next_due = dict()
+
+    def first_due(self, key):
+        # new keys are spread evenly over one interval by a stable hash of the key
+        offset = int(sha1(str(key).encode()).hexdigest()[:8], 16) % max(int(self.interval), 1)
+        return time() + offset
+
+    def due(self, keys):
+        """Return the keys that are due now"""
+
+        now = time()
+        due_keys = list()
+
+        for key in keys:
+            if key not in self.next_due:
+                self.next_due[key] = self.first_due(key)
+
+            if self.next_due[key] <= now:
+                due_keys.append(key)
+
+        return due_keys
+
+    def completed(self, key):
+        self.next_due[key] = time() + self.interval * (1 + uniform(-self.jitter, self.jitter))
+
+    def forget(self, keys):
+        """Drop keys that no longer exist"""
+
+        for key in set(self.next_due) - set(keys):
+            del self.next_due[key]
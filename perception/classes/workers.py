@@ -0,0 +1,53 @@
+import threading
+import syslog
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+
+class WorkerPool(object):
+    def __init__(self, name, workers=4, max_queue=0):
+        """Run submitted jobs on a fixed number of worker threads"""
+
+        self.name = name
+        self.workers = workers
+        self.jobs = Queue(maxsize=max_queue)
+        self.active = 0
+        self.lock = threading.Lock()
+
+        for i in range(workers):
+            t = threading.Thread(target=self.run, name='%s-%d' % (name, i))
+            t.daemon = True
+            t.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a job, blocks while the queue is full"""
+        self.jobs.put((func, args, kwargs))
+
+    def queue_depth(self):
+        return self.jobs.qsize()
+
+    def busy(self):
+        with self.lock:
+            return self.active
+
+    def run(self):
+
+        while True:
+            func, args, kwargs = self.jobs.get()
+
+            with self.lock:
+                self.active += 1
+
+            try:
+                func(*args, **kwargs)
+
+            except Exception as worker_e:
+                syslog.syslog(syslog.LOG_INFO, '%s worker error: %s' % (self.name, str(worker_e)))
+
+            finally:
+                with self.lock:
+                    self.active -= 1
+                self.jobs.task_done()
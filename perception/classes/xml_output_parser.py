@@ -1,13 +1,24 @@
 # TODO: fix in 0.6 (Make this a class)
 
-import xml.etree.ElementTree as ET
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 import syslog
 import json
 import time
-from socket import gethostbyaddr, herror
+from datetime import datetime
+from collections import OrderedDict, namedtuple
+from socket import inet_pton, inet_ntop, AF_INET6, error as socket_error
 from perception.config import configuration as config
 from perception.database.models import NmapHost, OpenVasVuln
 from perception.classes import esearch, sql
+from perception.classes.findings import save_findings
+from perception.classes.cpe import decode_cpe
+from perception.classes.resolver import get_resolver
+from perception.classes.network import normalize_address
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.postgresql import insert
 from perception.shared.functions import get_product_uuid
 
 system_uuid = get_product_uuid()
@@ -15,18 +26,6 @@ system_uuid = get_product_uuid()
 
 def parse_openvas_xml(openvas_xml, *args):
 
-    name = None
-    cvss = None
-    cve = None
-    host = None
-    threat = None
-    severity = None
-    family = None
-    port = None
-    bid = None
-    xrefs = None
-    tags = None
-
     #  Parse the openvas xml
     try:
         # TODO add test to see of it's a file or string
@@ -44,6 +43,19 @@ def parse_openvas_xml(openvas_xml, *args):
     # parse get_tasks_response
     if root.tag == 'get_tasks_response':
 
+        if args and args[0] == 'task_statuses':
+            task_statuses = dict()
+
+            for child in root.findall('task'):
+                try:
+                    progress = int(child.findtext('progress', '-1').strip())
+                except ValueError:
+                    progress = -1
+
+                task_statuses[child.attrib['id']] = (child.findtext('status'), progress)
+
+            return task_statuses
+
         task = root.iter('task')
         for child in task:
             status_element = child.find('status')
@@ -73,479 +85,497 @@ def parse_openvas_xml(openvas_xml, *args):
 
         return lsc_list
 
+    # parse get_port_lists_response
+    if root.tag == 'get_port_lists_response':
+
+        return [(port_list.findtext('name'), port_list.attrib['id']) for port_list in root.findall('port_list')]
+
+    # parse get_targets_response, with the name of each target's port list
+    if root.tag == 'get_targets_response':
+
+        return [(target.findtext('name'), target.attrib['id'], target.findtext('port_list/name'))
+                for target in root.findall('target')]
+
     # parse get_info
     if root.tag == 'get_info_response':
 
         if args[0] == 'nvt_oids':
-            nvt_dict_list = list()
-            nvt_list = list()
-            family_names = list()
+            families = OrderedDict()
 
+            # group the oids by family in one pass
             for x in root.iter('nvt'):
                 try:
                     nvt_family = x.find('family').text
                 except AttributeError:
                     continue
 
-                d = dict()
-                oid = x.attrib['oid']
-                d['family'] = nvt_family
-                d['oid'] = oid
-                nvt_list.append(d)
+                families.setdefault(nvt_family, list()).append(x.attrib['oid'])
 
-            for d in nvt_list:
-                if d['family'] not in family_names:
-                    family_names.append(d['family'])
+            return [{'family': fam, 'oids': oids} for fam, oids in families.items()]
 
-            for fam in family_names:
-                oid_list = list()
+    # parse get_reports_response
+    if root.tag == 'get_reports_response':
 
-                for nvtd in nvt_list:
-                    if nvtd['family'] == fam:
-                        oid_list.append(nvtd['oid'])
+        host_vulns = OrderedDict()
 
-                fam_d = dict()
-                fam_d['family'] = fam
-                fam_d['oids'] = oid_list
+        for results in root.iter('results'):
+            for result in results.findall('result'):
+                add_openvas_result(host_vulns, extract_openvas_result(result))
 
-                nvt_dict_list.append(fam_d)
+        report = root.find('report')
+        return store_openvas_vulns(host_vulns, report.get('id') if report is not None else None)
 
-            return nvt_dict_list
 
-    # parse get_reports_response
-    if root.tag == 'get_reports_response':
+# report <result> and <nvt> children that are kept, and the keys they are kept under
+openvas_result_fields = {'name': 'name',
+                         'host': 'host',
+                         'port': 'port',
+                         'threat': 'threat',
+                         'severity': 'severity'}
+openvas_nvt_fields = {'cvss_base': 'cvss',
+                      'cve': 'cve',
+                      'family': 'family',
+                      'bid': 'bid',
+                      'xref': 'xrefs',
+                      'tags': 'tags'}
 
-        openvas_db_session = sql.Sql.create_session()
 
-        results = root.iter('result')
-        vulnerability_list = list()
-        host_list = list()
+def extract_openvas_result(result):
+    """Read a report <result> element into a dict in one pass over its children"""
 
-        for result in results:
+    record = dict()
 
-            try:
-                name = result.find('name').text
-            except AttributeError:
-                pass
+    for child in result:
+        key = openvas_result_fields.get(child.tag)
 
-            try:
-                host = result.find('host').text
-                if host not in host_list:
-                    host_list.append(host)
-            except AttributeError:
-                pass
+        if key is not None:
+            record[key] = child.text
 
-            try:
-                threat = result.find('threat').text
-            except AttributeError:
-                pass
+        elif child.tag == 'nvt':
+            record['oid'] = child.get('oid')
 
-            try:
-                severity = result.find('severity').text
-            except AttributeError:
-                pass
+            for elem in child:
+                key = openvas_nvt_fields.get(elem.tag)
 
-            try:
-                port = result.find('port').text
-            except AttributeError:
-                pass
+                if key is not None:
+                    record[key] = elem.text
 
-            nvt = result.iter('nvt')
+        # the product the vulnerability was found in, from the result of the detection nvt
+        elif child.tag == 'detection':
 
-            # NVT info
+            for detail in child.iter('detail'):
+                if detail.findtext('name') == 'product':
+                    record['product'] = decode_cpe(detail.findtext('value'))
+                    break
 
-            for elem in nvt:
+    return record
 
-                try:
-                    cvss = elem.find('cvss_base').text
-                except AttributeError:
-                    pass
 
-                try:
-                    cve = elem.find('cve').text
-                except AttributeError:
-                    pass
+def add_openvas_result(host_vulns, record):
+    """Add an extracted result to the vulnerabilities of its host, results without a cvss score
+    only record that the host was scanned"""
 
-                try:
-                    family = elem.find('family').text
-                except AttributeError:
-                    pass
+    host = record.get('host')
 
-                try:
-                    bid = elem.find('bid').text
-                except AttributeError:
-                    pass
+    if not host:
+        return
 
-                try:
-                    xrefs = elem.find('xref').text
-                except AttributeError:
-                    pass
+    host = host.strip()
+    vulns = host_vulns.setdefault(normalize_address(host) or host, list())
+    cvss = record.get('cvss')
 
-                try:
-                    tags = elem.find('tags').text
-                except AttributeError:
-                    pass
+    try:
+        if float(cvss) <= 0.0:
+            return
+    except (TypeError, ValueError):
+        return
+
+    vulns.append({'openvas_vuln_oid': record.get('oid'),
+                  'openvas_vuln_name': record.get('name'),
+                  'openvas_vuln_cvss_score': cvss,
+                  'openvas_vuln_cve_id': record.get('cve'),
+                  'openvas_vuln_family': record.get('family'),
+                  'openvas_vuln_bug_id': record.get('bid'),
+                  'openvas_vuln_port': record.get('port'),
+                  'openvas_vuln_threat_score': record.get('threat'),
+                  'openvas_vuln_severity_score': record.get('severity'),
+                  'openvas_vuln_xrefs': record.get('xrefs'),
+                  'openvas_vuln_tags': record.get('tags')})
+
+    product = record.get('product')
+
+    if product is not None:
+        vulns[-1].update(openvas_vuln_cpe=product.cpe,
+                         openvas_vuln_product_vendor=product.vendor,
+                         openvas_vuln_product_name=product.name,
+                         openvas_vuln_product_version=product.version)
+
+
+def store_openvas_vulns(host_vulns, report_id=None):
+    """Store the vulnerabilities of each scanned host, a report can cover several hosts when
+    they were scanned in one task. With a report_id every vulnerability is also saved as a
+    finding and compared with the host's previous report. Returns 0, or 99 when there were no hosts."""
+
+    openvas_db_session = sql.Sql.create_session()
+    hosts = list()
+
+    for vuln_ip, vulnerability_list in host_vulns.items():
+
+        openvas_vuln = sql.Sql.get_or_create(openvas_db_session,
+                                             OpenVasVuln,
+                                             ip_addr=vuln_ip,
+                                             perception_product_uuid=system_uuid)
+        openvas_vuln.last_scanned_at = datetime.now()
+        hosts.append((openvas_vuln, vulnerability_list))
 
-            if float(cvss) > 0.0:
+    openvas_db_session.commit()
+    diffs = dict()
 
-                vulnerability = {'openvas_vuln_name': name,
-                                 'openvas_vuln_cvss_score': cvss,
-                                 'openvas_vuln_cve_id': cve,
-                                 'openvas_vuln_family': family,
-                                 'openvas_vuln_bug_id': bid,
-                                 'openvas_vuln_port': port,
-                                 'openvas_vuln_threat_score': threat,
-                                 'openvas_vuln_severity_score': severity,
-                                 'openvas_vuln_xrefs': xrefs,
-                                 'openvas_vuln_tags': tags}
+    if report_id is not None and hosts:
+        try:
+            diffs = save_findings(openvas_db_session, report_id, hosts)
 
-                vulnerability_list.append(vulnerability)
+        except SQLAlchemyError as findings_e:
+            openvas_db_session.rollback()
+            syslog.syslog(syslog.LOG_INFO, 'OpenVas error: could not save findings of report %s: %s'
+                          % (report_id, str(findings_e)))
 
-        if len(host_list) == 1:
+    for openvas_vuln, vulnerability_list in hosts:
 
-            vuln_host = {'openvas_vuln_perception_product_uuid': system_uuid,
-                         'openvas_vuln_scan_timestamp': int(time.time()),
-                         'vulns': vulnerability_list}
+        vuln_host = {'openvas_vuln_perception_product_uuid': system_uuid,
+                     'openvas_vuln_scan_timestamp': int(time.time()),
+                     'vulns': vulnerability_list}
 
-            openvas_vuln = sql.Sql.get_or_create(openvas_db_session,
-                                                 OpenVasVuln,
-                                                 ip_addr=host_list[0],
-                                                 perception_product_uuid=system_uuid)
+        diff = diffs.get(openvas_vuln.ip_addr)
 
-            openvas_json_data = json.dumps(vuln_host)
+        if diff is not None:
+            vuln_host['openvas_vuln_new_count'] = len(diff['new'])
+            vuln_host['openvas_vuln_fixed_count'] = len(diff['fixed'])
 
-            if config.es_direct:
-                esearch.Elasticsearch.add_document(config.es_host,
-                                                   config.es_port,
-                                                   config.es_index,
-                                                   'openvas',
-                                                   str(openvas_vuln.id),
-                                                   openvas_json_data)
+        openvas_json_data = json.dumps(vuln_host)
 
-            openvas_db_session.close()
-            return 0
+        if config.es_direct:
+            esearch.Elasticsearch.add_document(config.es_host,
+                                               config.es_port,
+                                               config.es_index,
+                                               'openvas',
+                                               str(openvas_vuln.id),
+                                               openvas_json_data)
 
+    openvas_db_session.close()
+
+    if host_vulns:
+        return 0
+
+    return 99
+
+
+def read_openvas_results(events, host_vulns):
+    """Add the results of the iterparse end events of a get_reports response to host_vulns,
+    clearing each result once it is read. Returns the response status and the number of results."""
+
+    status = None
+    results = 0
+
+    for event, elem in events:
+
+        if elem.tag == 'result':
+            record = extract_openvas_result(elem)
+
+            # results nested in a result's detection have no host, they are kept until the result
+            # they belong to is read
+            if record.get('host'):
+                add_openvas_result(host_vulns, record)
+                results += 1
+                elem.clear()
+
+        elif elem.tag == 'get_reports_response':
+            status = elem.get('status')
+
+    return status, results
+
+
+def iter_nmap_hosts(source):
+    """Yield each <host> element of nmap xml output (a file name or file object) as soon as it is
+    complete, then free it, so memory does not grow with the size of the scan"""
+
+    root = None
+
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+
+        if root is None:
+            root = elem
+
+        if event == 'end' and elem.tag == 'host':
+            yield elem
+            root.clear()
+
+
+# one open port of a host, cpe is the decoded service cpe or None
+NmapPort = namedtuple('NmapPort', 'protocol portid name product extra_info cpe')
+
+# everything kept of a live host in nmap output
+NmapHostRecord = namedtuple('NmapHostRecord', 'ipv4 ipv6 mac_addr mac_vendor os_type os_cpe state host_name '
+                                              'adjacency_switch adjacency_int ports')
+
+def extract_nmap_host(host, nmap_info, host_info=None):
+    """Walk a <host> element once and return its NmapHostRecord, or None if the host is not up.
+    nmap_info is the (mac, mac_vendor, adjacency_switch, adjacency_int) the scan was run with."""
+
+    mac_addr, mac_vendor, adjacency_switch, adjacency_int = nmap_info
+    state = None
+    ipv4 = None
+    ipv6 = None
+    host_name = None
+    os_type = None
+    os_cpe = None
+    ports = list()
+
+    for child in host:
+        tag = child.tag
+
+        if tag == 'status':
+            state = child.get('state')
+
+            if state != 'up':
+                return None
+
+        elif tag == 'address':
+            addrtype = child.get('addrtype')
+
+            if addrtype == 'ipv4':
+                ipv4 = child.get('addr')
+
+            elif addrtype == 'mac':
+                mac_addr = child.get('addr')
+                mac_vendor = child.get('vendor')
+
+            elif addrtype == 'ipv6':
+                ipv6 = child.get('addr')
+
+        elif tag == 'hostnames':
+            hostname = child.find('hostname')
+
+            if hostname is not None:
+                host_name = hostname.get('name')
+
+        elif tag == 'ports':
+
+            for port in child:
+
+                if port.tag != 'port':
+                    continue
+
+                service = port.find('service')
+
+                if service is None:
+                    ports.append(NmapPort(port.get('protocol'), port.get('portid'), None, None, None, None))
+                    continue
+
+                ports.append(NmapPort(port.get('protocol'),
+                                      port.get('portid'),
+                                      service.get('name'),
+                                      service.get('product'),
+                                      service.get('extrainfo'),
+                                      decode_cpe(service.findtext('cpe'))))
+
+        elif tag == 'os':
+            osmatch = child.find('osmatch')
+            osclass = osmatch.find('osclass') if osmatch is not None else None
+
+            if osclass is not None:
+                os_type = osclass.get('type')
+                os_cpe = osclass.findtext('cpe') or None
+
+    if state != 'up':
+        return None
+
+    if host_info is not None and ipv4 in host_info:
+        batch_mac_addr, batch_mac_vendor, adjacency_switch, adjacency_int = host_info[ipv4]
+
+        if mac_addr is None:
+            mac_addr = batch_mac_addr
+            mac_vendor = batch_mac_vendor
+
+    return NmapHostRecord(ipv4, ipv6, mac_addr, mac_vendor, os_type, os_cpe, state, host_name,
+                          adjacency_switch, adjacency_int, ports)
+
+
+def nmap_document(record):
+    """The Elasticsearch nmap document of a NmapHostRecord"""
+
+    ports = list()
+
+    for port in record.ports:
+        inventory_port = {'protocol': port.protocol,
+                          'portid': port.portid,
+                          'name': port.name,
+                          'product': port.product,
+                          'extra_info': port.extra_info}
+
+        if port.cpe is not None:
+            inventory_port['svc_product'] = {'cpe': port.cpe.cpe,
+                                             'product_type': port.cpe.product_type,
+                                             'svc_cpe_product_vendor': port.cpe.vendor,
+                                             'name': port.cpe.name,
+                                             'version': port.cpe.version,
+                                             'product_update': port.cpe.update,
+                                             'edition': port.cpe.edition,
+                                             'language': port.cpe.language}
+
+        ports.append(inventory_port)
+
+    inventory_host = {'nmap_ipv4': record.ipv4,
+                      'nmap_ipv6': record.ipv6,
+                      'nmap_mac_addr': record.mac_addr,
+                      'nmap_os_type': record.os_type,
+                      'nmap_mac_vendor': record.mac_vendor,
+                      'nmap_state': record.state,
+                      'nmap_host_name': record.host_name,
+                      'nmap_product': record.os_cpe,
+                      'nmap_adjacency_switch': record.adjacency_switch,
+                      'nmap_adjacency_int': record.adjacency_int}
+
+    return {'nmap_inventory_host': inventory_host,
+            'nmap_ports': ports,
+            'nmap_perception_product_uuid': system_uuid,
+            'nmap_timestamp': int(time.time())}
+
+
+def inet_key(ip_addr):
+    """The text postgres returns for an inet, ipv6 addresses are compressed and lower case"""
+
+    if ':' in ip_addr:
+        try:
+            return inet_ntop(AF_INET6, inet_pton(AF_INET6, ip_addr))
+        except (socket_error, ValueError):
+            pass
+
+    return ip_addr
+
+
+class NmapHostSink(object):
+    def __init__(self, session, flush_size=None, full_scan=True):
+        """Collect the hosts of an nmap scan and store them flush_size at a time, the NmapHost rows
+        with one upsert that returns their ids and the documents with one bulk request. Hosts nmap
+        found no name for are reverse looked up together before their documents are built.
+        Only a full_scan, the -A host profile, stamps last_scanned_at, a -sV cider sweep leaves it."""
+
+        self.session = session
+        self.flush_size = max(1, flush_size or getattr(config, 'nmap_flush_size', 500))
+        self.full_scan = full_scan
+        self.records = OrderedDict()
+
+    def add(self, record):
+
+        ip_addr = record.ipv4 or record.ipv6
+
+        if ip_addr is None:
+            return
+
+        self.records[inet_key(ip_addr)] = record
+
+        if len(self.records) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+
+        records = self.records
+        self.records = OrderedDict()
+
+        if not records:
+            return
+
+        now = datetime.now()
+        scanned_at = now if self.full_scan else None
+        stmt = insert(NmapHost.__table__).values([{'ip_addr': ip_addr,
+                                                   'perception_product_uuid': system_uuid,
+                                                   'created_at': now,
+                                                   'last_scanned_at': scanned_at} for ip_addr in records])
+
+        # the update is still needed without a stamp, returning only gives the ids of updated rows
+        if self.full_scan:
+            stmt = stmt.on_conflict_do_update(index_elements=['ip_addr'],
+                                              set_={'last_scanned_at': stmt.excluded.last_scanned_at})
         else:
-            openvas_db_session.close()
-            return 99
+            stmt = stmt.on_conflict_do_update(index_elements=['ip_addr'],
+                                              set_={'last_scanned_at': NmapHost.__table__.c.last_scanned_at})
 
+        try:
+            host_ids = dict((str(ip_addr), host_id) for host_id, ip_addr in
+                            self.session.execute(stmt.returning(NmapHost.id, NmapHost.ip_addr)))
+            self.session.commit()
 
-def parse_nmap_xml(nmap_results):
+        except SQLAlchemyError as sink_e:
+            self.session.rollback()
+            syslog.syslog(syslog.LOG_INFO, 'Could not store %d Nmap hosts: %s' % (len(records), str(sink_e)))
+            return
 
-    #  Parse the nmap xml file and build the tree
-    try:
-        tree = ET.parse(nmap_results[0])
-        root = tree.getroot()
+        # name the hosts nmap could not, with one batch of reverse lookups
+        host_names = get_resolver().lookup_many([ip_addr for ip_addr, record in records.items()
+                                                 if record.host_name is None])
+        docs = list()
+
+        for ip_addr, record in records.items():
+            host_id = host_ids.get(ip_addr)
+
+            if host_id is None:
+                continue
+
+            if record.host_name is None and host_names.get(ip_addr):
+                record = record._replace(host_name=host_names[ip_addr])
+
+            docs.append(('nmap', str(host_id), json.dumps(nmap_document(record))))
+
+        esearch.Elasticsearch.bulk_index(config.es_host, config.es_port, config.es_index, docs)
 
-    except ET.ParseError:
-        return 99
+
+def parse_nmap_xml(nmap_results, host_info=None, full_scan=True, on_host=None):
+    """Parse nmap xml output and store each live host, host_info optionally maps ip addresses of
+    a batch scan to their (mac, mac_vendor, adjacency_switch, adjacency_int), full_scan is False
+    for scans that must not mark their hosts as scanned. The hosts are not kept, a caller that
+    needs them passes on_host, which is called with the NmapHostRecord of each one. Returns the
+    number of live hosts or 99."""
+
+    nmap_db_session = sql.Sql.create_session()
+    sink = NmapHostSink(nmap_db_session, full_scan=full_scan)
+    host_count = 0
+
+    if len(nmap_results) == 5:
+        nmap_info = tuple(nmap_results[1:])
+    else:
+        nmap_info = (None, None, None, None)
 
     try:
-        #  Find all the hosts in the nmap scan
-        nmap_db_session = sql.Sql.create_session()
-        host_list = list()
-
-        for host in root.findall('host'):
-
-            port_dict_list = list()
-            port_list = list()
-
-            ipv4 = None
-            ipv6 = None
-            ip_addr = None
-
-            if len(nmap_results) == 5:
-                mac_addr = nmap_results[1]
-                mac_vendor = nmap_results[2]
-                adjacency_switch = nmap_results[3]
-                adjacency_int = nmap_results[4]
-            else:
-                mac_addr = None
-                mac_vendor = None
-                adjacency_switch = None
-                adjacency_int = None
-
-            os_type = None
-            host_name = None
-            product = None
-            product_type = None
-            product_vendor = None
-            product_name = None
-            product_version = None
-            product_update = None
-            product_edition = None
-            product_language = None
-
-            os_cpe = str()
-
-            #  Get the hosts state, and find all addresses
-            state = host[0].get('state')
-
-            if state == 'up':
-
-                addresses = host.findall('address')
-                for address in addresses:
-
-                    if address.attrib.get('addrtype') == 'ipv4':
-                        ipv4 = address.attrib.get('addr')
-
-                    if address.attrib.get('addrtype') == 'mac':
-                        mac_addr = address.attrib.get('addr')
-                        mac_vendor = address.attrib.get('vendor')
-
-                    if address.attrib.get('addrtype') == 'ipv6':
-                        ipv6 = address.attrib.get('addr')
-
-                # Get the hostname
-                host_info = host.find('hostnames')
-                findhostname = host_info.find('hostname')
-                try:
-                    host_name = findhostname.get('name')
-                except AttributeError:
-                    pass
+        #  Handle each host in the nmap scan as soon as it is parsed, the sink stores them in chunks
+        for host in iter_nmap_hosts(nmap_results[0]):
 
-                # Get OS Info
-                os_elm = host.find('os')
-                try:
-                    osmatch_elm = os_elm.find('osmatch')
-                    osclass_elm = osmatch_elm.findall('osclass')
-                    os_type = osclass_elm[0].get('type')
-                    try:
-                        os_cpe = osclass_elm[0][0].text
-                    except IndexError:
-                        pass
-                except AttributeError:
-                    pass
+            record = extract_nmap_host(host, nmap_info, host_info)
 
-                # Build product info for host OS
-                try:
-                    os_product = os_cpe.split(':')
-                except AttributeError:
-                    pass
-                try:
-                    product_type = os_product[1].replace('/', '')
-                except IndexError:
-                    pass
-                try:
-                    product_vendor = os_product[2]
-                except IndexError:
-                    pass
-                try:
-                    product_name = os_product[3]
-                except IndexError:
-                    pass
-                try:
-                    product_version = os_product[4]
-                except IndexError:
-                    pass
-                try:
-                    product_update = os_product[5]
-                except IndexError:
-                    pass
-                try:
-                    product_edition = os_product[6]
-                except IndexError:
-                    pass
-                try:
-                    product_language = os_product[6]
-                except IndexError:
-                    pass
+            if record is None:
+                continue
 
-                try:
-                    if host_name is None:
-                        host_name = gethostbyaddr(ipv4)[0]
-                except herror:
-                    pass
-
-                if os_product != ['']:
-
-                    product = {'cpe': os_cpe,
-                               'product_type': product_type,
-                               'p_vendor': product_vendor,
-                               'name': product_name,
-                               'version': product_version,
-                               'product_update': product_update,
-                               'edition': product_edition,
-                               'language': product_language}
-
-                # Find all port Info
-                port_info = host.findall('ports')
-
-                for ports in port_info:
-
-                    p = ports.findall('port')
-                    for each_port in p:
-
-                        service_name = None
-                        service_product = None
-                        ex_info = None
-                        svc_cpe_product = None
-
-                        svc_cpe = str()
-                        svc_cpe_product_type = str()
-                        svc_cpe_product_vendor = str()
-
-                        svc_cpe_product_name = None
-                        svc_cpe_product_version = None
-                        svc_cpe_product_update = None
-                        svc_cpe_product_edition = None
-                        svc_cpe_product_language = None
-
-                        protocol = each_port.get('protocol')
-                        portid = each_port.get('portid')
-                        service_info = each_port.find('service')
-                        findall_cpe = service_info.findall('cpe')
-
-                        try:
-                            svc_cpe = findall_cpe[0].text
-                        except IndexError:
-                            pass
-                        try:
-                            ex_info = service_info.get('extrainfo')
-                        except IndexError:
-                            pass
-
-                        try:
-                            service_name = service_info.get('name')
-                        except IndexError:
-                            pass
-
-                        try:
-                            service_product = service_info.get('product')
-                        except IndexError:
-                            pass
-
-                            #  Build product info for SVC CPE
-                        try:
-                            svc_cpe_product = svc_cpe.split(':')
-                        except AttributeError:
-                            pass
-
-                        if svc_cpe_product == ['']:
-
-                            inventory_port = {'protocol': protocol,
-                                              'portid': portid,
-                                              'name': service_name,
-                                              'product': service_product,
-                                              'extra_info': ex_info}
-
-                            port_dict_list.append(inventory_port)
-
-                        elif svc_cpe_product is not None:
-
-                            try:
-                                svc_cpe_product_type = svc_cpe_product[1].replace('/', '')
-                            except IndexError:
-                                pass
-                            try:
-                                svc_cpe_product_vendor = svc_cpe_product[2]
-                            except IndexError:
-                                pass
-                            try:
-                                svc_cpe_product_name = svc_cpe_product[3]
-                            except IndexError:
-                                pass
-                            try:
-                                svc_cpe_product_version = svc_cpe_product[4]
-                            except IndexError:
-                                pass
-                            try:
-                                svc_cpe_product_update = svc_cpe_product[5]
-                            except IndexError:
-                                pass
-                            try:
-                                svc_cpe_product_edition = svc_cpe_product[6]
-                            except IndexError:
-                                pass
-                            try:
-                                svc_cpe_product_language = svc_cpe_product[6]
-                            except IndexError:
-                                pass
-
-                            svc_product = {'cpe': svc_cpe,
-                                           'product_type': svc_cpe_product_type,
-                                           'svc_cpe_product_vendor': svc_cpe_product_vendor,
-                                           'name': svc_cpe_product_name,
-                                           'version': svc_cpe_product_version,
-                                           'product_update': svc_cpe_product_update,
-                                           'edition': svc_cpe_product_edition,
-                                           'language': svc_cpe_product_language}
-
-                            inventory_port = {'protocol': protocol,
-                                              'portid': portid,
-                                              'name': service_name,
-                                              'product': service_product,
-                                              'extra_info': ex_info,
-                                              'svc_product': svc_product}
-
-                            port_dict = {'protocol': protocol,
-                                         'portid': portid,
-                                         'svc_cpe_product_name': svc_cpe_product_name,
-                                         'svc_cpe_product_version': svc_cpe_product_version}
-
-                            port_dict_list.append(inventory_port)
-                            port_list.append(port_dict)
+            host_count += 1
+            sink.add(record)
 
-                try:
-                    inventory_host = {'nmap_ipv4': ipv4,
-                                      'nmap_ipv6': ipv6,
-                                      'nmap_mac_addr': mac_addr,
-                                      'nmap_os_type': os_type,
-                                      'nmap_mac_vendor': mac_vendor,
-                                      'nmap_state': state,
-                                      'nmap_host_name': host_name,
-                                      'nmap_product': product['cpe'],
-                                      'nmap_adjacency_switch': adjacency_switch,
-                                      'nmap_adjacency_int': adjacency_int}
-
-                except TypeError:
-                    inventory_host = {'nmap_ipv4': ipv4,
-                                      'nmap_ipv6': ipv6,
-                                      'nmap_mac_addr': mac_addr,
-                                      'nmap_os_type': os_type,
-                                      'nmap_mac_vendor': mac_vendor,
-                                      'nmap_state': state,
-                                      'nmap_host_name': host_name,
-                                      'nmap_product': None,
-                                      'nmap_adjacency_switch': adjacency_switch,
-                                      'nmap_adjacency_int': adjacency_int}
-
-                host_dict = {'nmap_inventory_host': inventory_host,
-                             'nmap_ports': port_dict_list,
-                             'nmap_perception_product_uuid': system_uuid,
-                             'nmap_timestamp': int(time.time())}
-
-                host_dict_4ov = {'ipv4': ipv4,
-                                 'ipv6': ipv6,
-                                 'mac_vendor': mac_vendor,
-                                 'port_list': port_list}
-
-                host_list.append(host_dict_4ov)
-
-                if ipv4:
-                    ip_addr = ipv4
-
-                elif ipv6:
-                    ip_addr = ipv6
-
-                if ip_addr is not None:
-                    nmap_host = sql.Sql.get_or_create(nmap_db_session,
-                                                      NmapHost,
-                                                      ip_addr=ip_addr,
-                                                      perception_product_uuid=system_uuid)
-
-                    nmap_json_data = json.dumps(host_dict)
-
-                    esearch.Elasticsearch.add_document(config.es_host,
-                                                       config.es_port,
-                                                       config.es_index,
-                                                       'nmap',
-                                                       str(nmap_host.id),
-                                                       nmap_json_data)
+            if on_host is not None:
+                on_host(record)
 
-        nmap_db_session.close()
-        return host_list
+        return host_count
+
+    except ET.ParseError as parse_e:
+        syslog.syslog(syslog.LOG_INFO, 'Could not parse the Nmap XML output after %d hosts: %s'
+                      % (host_count, str(parse_e)))
+
+        if host_count:
+            return host_count
+
+        return 99
 
     except Exception as nmap_xml_e:
         syslog.syslog(syslog.LOG_INFO, '####  Failed to parse the Nmap XML output file %s  ####' % str(nmap_results))
         syslog.syslog(syslog.LOG_INFO, str(nmap_xml_e))
+
+    finally:
+        sink.flush()
+        nmap_db_session.close()
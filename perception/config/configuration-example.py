@@ -22,6 +22,101 @@ db_password = 'perceptiondb_user_password'
 # ----------------
 discovery_mode = 'passive'
 
+# SeedStarter, DiscoveryProtocolSpider, RSInventoryUpdater and OpenVasUpdater
+# passes allowed to run at the same time
+scheduler_max_concurrency = 3
+
+# -------------------------
+# Nmap
+# -------------------------
+# in active discovery mode the local hosts of a device are split across at
+# most nmap_batch_processes nmap processes
+nmap_batch_processes = 4
+nmap_min_hostgroup = 64
+nmap_min_parallelism = 16
+
+# every nmap run goes through one queue, at most nmap_max_processes run at
+# once and at most nmap_subnet_rate scans start per /24 per minute
+nmap_max_processes = 4
+nmap_subnet_rate = 10
+
+# read nmap's xml output from a pipe while the scan runs, instead of from a
+# file in /tmp/perception/nmap/ once it is done
+nmap_stream = False
+
+# scanned hosts are stored nmap_flush_size at a time, one upsert for their
+# nmap_hosts rows and one Elasticsearch bulk request for their documents
+nmap_flush_size = 500
+
+# hosts fully scanned, nmap -A (openvas), within the last nmap_cache_ttl
+# (openvas_cache_ttl) seconds are skipped unless the scan is forced,
+# ie. run discovery on 10.1.1.1 force, -sV cider sweeps do not count
+nmap_cache_ttl = 3600
+openvas_cache_ttl = 86400
+
+# distinct cpes kept decoded, the same products are seen on most hosts
+cpe_cache_size = 4096
+
+# -------------------------
+# Reverse DNS
+# -------------------------
+# host names are looked up with PTR queries to dns_nameserver, a nameserver
+# or a list of them, or the nameservers in /etc/resolv.conf when None. Each
+# nameserver is asked in order for the addresses the one before did not
+# answer, and addresses still without a name are looked up with the system
+# resolver, so /etc/hosts is used too. Each query waits dns_timeout seconds
+# and is retried dns_retries times, at most dns_concurrency queries are in
+# flight. Names are cached up to dns_cache_ttl seconds and addresses without
+# a name for dns_negative_ttl seconds.
+dns_nameserver = None
+dns_timeout = 2
+dns_retries = 1
+dns_concurrency = 64
+dns_cache_ttl = 3600
+dns_negative_ttl = 300
+
+# -------------------------
+# OpenVas
+# -------------------------
+# each worker keeps one authenticated session with the OpenVas Manager,
+# seconds to wait on a response before reconnecting
+openvas_omp_timeout = 600
+
+# hosts with the same open ports are vulnerability scanned in one task, at
+# most openvas_batch_size hosts per task
+openvas_batch_size = 32
+
+# running tasks are polled together, every openvas_poll_min seconds at first
+# and backing off to openvas_poll_max while no task is close to done
+openvas_poll_min = 5
+openvas_poll_max = 30
+
+# reports are fetched openvas_report_rows results at a time, only results
+# with a severity above 0
+openvas_report_rows = 500
+
+# targets and port lists are shared by scans with the same hosts and ports,
+# and deleted once unused for openvas_object_ttl seconds
+openvas_object_ttl = 86400
+
+# the daily NVT, SCAP and CERT feed syncs run one after the other, progress is
+# logged every openvas_sync_progress seconds. Running them at the same time is
+# faster, but the community feed rate limits concurrent rsyncs, so only set
+# openvas_parallel_sync with a private feed. New scans wait while the database
+# is rebuilt after the syncs, the rebuild waits up to openvas_rebuild_drain
+# seconds for running scans and is retried on the next pass if they are not done.
+openvas_parallel_sync = False
+openvas_sync_progress = 60
+openvas_rebuild_drain = 600
+
+# credentialed scans, Windows hosts are scanned with the smb login and Linux
+# and Unix hosts with the ssh login, by the OS nmap matched. Leave the login
+# as None to scan without logging in.
+openvas_ssh_login = None
+openvas_ssh_password = None
+openvas_smb_login = None
+openvas_smb_password = None
+
 # -------------------------------------
 # You should not uncomment and use this
 # Just setup PKI and stop being lazy
@@ -39,6 +134,24 @@ mq_ssl = False
 mq_user = 'guest'
 mq_password = 'guest'
 
+# messages handed to the daemon at once, and the threads that work them
+mq_prefetch = 8
+mq_workers = 4
+
+# -------------------------
+# Cluster
+# -------------------------
+# share nmap and openvas jobs with other perceptiond nodes,
+# large ciders are split into /cluster_partition_prefix blocks and host lists
+# into cluster_chunk_size hosts per job
+cluster_mode = False
+cluster_partition_prefix = 24
+cluster_chunk_size = 64
+
+# nodes that have not checked in for cluster_node_ttl seconds lose their
+# share of the RSInventoryUpdater sweep to the remaining nodes
+cluster_node_ttl = 300
+
 # --------------------------
 # Elasticsearch Indexer Info
 # --------------------------
@@ -0,0 +1,33 @@
+"""create perception_nodes table
+
+Revision ID: 3f9d2c7a1b64
+Revises: 506c8e35ba7c
+Create Date: 2026-10-19 09:12:41.204518
+
+"""
+from sqlalchemy.dialects import postgresql
+from alembic import op
+import sqlalchemy as sa
+import datetime
+
+
+def _get_date():
+    return datetime.datetime.now()
+
+# revision identifiers, used by Alembic.
+revision = '3f9d2c7a1b64'
+down_revision = '506c8e35ba7c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('perception_nodes',
+                    sa.Column('id', sa.Integer, primary_key=True, nullable=False),
+                    sa.Column('perception_product_uuid', postgresql.UUID, unique=True, nullable=False),
+                    sa.Column('last_seen_at', sa.TIMESTAMP(timezone=True), default=_get_date, index=True),
+                    sa.Column('created_at', sa.TIMESTAMP(timezone=True), default=_get_date))
+
+
+def downgrade():
+    op.drop_table('perception_nodes')
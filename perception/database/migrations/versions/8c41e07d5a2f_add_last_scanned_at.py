@@ -0,0 +1,25 @@
+"""add last_scanned_at to nmap_hosts and openvas_vulns
+
+Revision ID: 8c41e07d5a2f
+Revises: 3f9d2c7a1b64
+Create Date: 2026-10-19 10:03:12.551820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8c41e07d5a2f'
+down_revision = '3f9d2c7a1b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('nmap_hosts', sa.Column('last_scanned_at', sa.TIMESTAMP(timezone=True)))
+    op.add_column('openvas_vulns', sa.Column('last_scanned_at', sa.TIMESTAMP(timezone=True)))
+
+
+def downgrade():
+    op.drop_column('openvas_vulns', 'last_scanned_at')
+    op.drop_column('nmap_hosts', 'last_scanned_at')
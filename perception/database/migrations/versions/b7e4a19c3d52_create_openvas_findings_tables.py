@@ -0,0 +1,77 @@
+"""create openvas reports, nvts, cves and findings tables
+
+Revision ID: b7e4a19c3d52
+Revises: 8c41e07d5a2f
+Create Date: 2026-10-19 14:37:05.913264
+
+"""
+from sqlalchemy.dialects import postgresql
+from alembic import op
+import sqlalchemy as sa
+import datetime
+
+
+def _get_date():
+    return datetime.datetime.now()
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4a19c3d52'
+down_revision = '8c41e07d5a2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('openvas_reports',
+                    sa.Column('id', sa.Integer, primary_key=True, nullable=False),
+                    sa.Column('perception_product_uuid', postgresql.UUID, nullable=False),
+                    sa.Column('report_id', sa.Text, unique=True, nullable=False),
+                    sa.Column('created_at', sa.TIMESTAMP(timezone=True), default=_get_date))
+
+    op.create_table('openvas_nvts',
+                    sa.Column('id', sa.Integer, primary_key=True, nullable=False),
+                    sa.Column('oid', sa.Text, unique=True, nullable=False),
+                    sa.Column('name', sa.Text),
+                    sa.Column('family', sa.Text),
+                    sa.Column('cvss_base', sa.Float),
+                    sa.Column('bid', sa.Text),
+                    sa.Column('xrefs', sa.Text),
+                    sa.Column('tags', sa.Text))
+
+    op.create_table('openvas_cves',
+                    sa.Column('id', sa.Integer, primary_key=True, nullable=False),
+                    sa.Column('cve_id', sa.Text, unique=True, nullable=False))
+
+    op.create_table('openvas_nvt_cves',
+                    sa.Column('openvas_nvt_id', sa.Integer,
+                              sa.ForeignKey('openvas_nvts.id', ondelete='cascade'), primary_key=True),
+                    sa.Column('openvas_cve_id', sa.Integer,
+                              sa.ForeignKey('openvas_cves.id', ondelete='cascade'), primary_key=True, index=True))
+
+    op.create_table('openvas_findings',
+                    sa.Column('id', sa.Integer, primary_key=True, nullable=False),
+                    sa.Column('openvas_report_id', sa.Integer,
+                              sa.ForeignKey('openvas_reports.id', ondelete='cascade'), nullable=False),
+                    sa.Column('openvas_vuln_id', sa.Integer,
+                              sa.ForeignKey('openvas_vulns.id', ondelete='cascade'), nullable=False),
+                    sa.Column('openvas_nvt_id', sa.Integer,
+                              sa.ForeignKey('openvas_nvts.id'), nullable=False, index=True),
+                    sa.Column('port', sa.Text),
+                    sa.Column('threat', sa.Text),
+                    sa.Column('severity', sa.Float),
+                    sa.Column('is_new', sa.Boolean, default=False, index=True),
+                    sa.Column('created_at', sa.TIMESTAMP(timezone=True), default=_get_date))
+
+    op.create_index('ix_openvas_findings_vuln_report', 'openvas_findings', ['openvas_vuln_id', 'openvas_report_id'])
+
+    op.add_column('openvas_vulns', sa.Column('last_report_id', sa.Integer, sa.ForeignKey('openvas_reports.id')))
+
+
+def downgrade():
+    op.drop_column('openvas_vulns', 'last_report_id')
+    op.drop_index('ix_openvas_findings_vuln_report', 'openvas_findings')
+    op.drop_table('openvas_findings')
+    op.drop_table('openvas_nvt_cves')
+    op.drop_table('openvas_cves')
+    op.drop_table('openvas_nvts')
+    op.drop_table('openvas_reports')
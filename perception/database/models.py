@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, Integer, Text, ForeignKey, TIMESTAMP, String
+from sqlalchemy import Column, Integer, Text, ForeignKey, TIMESTAMP, String, Float, Boolean, Index
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -178,6 +178,7 @@ class NmapHost(Base):
     perception_product_uuid = Column(postgresql.UUID, nullable=False)
     ip_addr = Column(postgresql.INET, unique=True, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), default=_get_date)
+    last_scanned_at = Column(TIMESTAMP(timezone=True))
 
 
 class OpenVasVuln(Base):
@@ -187,3 +188,69 @@ class OpenVasVuln(Base):
     perception_product_uuid = Column(postgresql.UUID, nullable=False)
     ip_addr = Column(postgresql.INET, unique=True, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), default=_get_date)
+    last_scanned_at = Column(TIMESTAMP(timezone=True))
+    last_report_id = Column(Integer, ForeignKey('openvas_reports.id'))
+
+
+class OpenVasReport(Base):
+    __tablename__ = 'openvas_reports'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    perception_product_uuid = Column(postgresql.UUID, nullable=False)
+    report_id = Column(Text, unique=True, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), default=_get_date)
+
+
+class OpenVasNvt(Base):
+    __tablename__ = 'openvas_nvts'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    oid = Column(Text, unique=True, nullable=False)
+    name = Column(Text)
+    family = Column(Text)
+    cvss_base = Column(Float)
+    bid = Column(Text)
+    xrefs = Column(Text)
+    tags = Column(Text)
+
+
+class OpenVasCve(Base):
+    __tablename__ = 'openvas_cves'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    cve_id = Column(Text, unique=True, nullable=False)
+
+
+class OpenVasNvtCve(Base):
+    __tablename__ = 'openvas_nvt_cves'
+
+    openvas_nvt_id = Column(Integer, ForeignKey('openvas_nvts.id', ondelete='cascade'), primary_key=True)
+    openvas_cve_id = Column(Integer, ForeignKey('openvas_cves.id', ondelete='cascade'), primary_key=True, index=True)
+
+
+class OpenVasFinding(Base):
+    __tablename__ = 'openvas_findings'
+    __table_args__ = (Index('ix_openvas_findings_vuln_report', 'openvas_vuln_id', 'openvas_report_id'),)
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    openvas_report_id = Column(Integer, ForeignKey('openvas_reports.id', ondelete='cascade'), nullable=False)
+    openvas_vuln_id = Column(Integer, ForeignKey('openvas_vulns.id', ondelete='cascade'), nullable=False)
+    openvas_nvt_id = Column(Integer, ForeignKey('openvas_nvts.id'), nullable=False, index=True)
+    port = Column(Text)
+    threat = Column(Text)
+    severity = Column(Float)
+    is_new = Column(Boolean, default=False, index=True)
+    created_at = Column(TIMESTAMP(timezone=True), default=_get_date)
+
+    openvas_report = relationship('OpenVasReport', backref='openvas_findings', order_by=id)
+    openvas_vuln = relationship('OpenVasVuln', backref='openvas_findings', order_by=id)
+    openvas_nvt = relationship('OpenVasNvt', backref='openvas_findings', order_by=id)
+
+
+class PerceptionNode(Base):
+    __tablename__ = 'perception_nodes'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    perception_product_uuid = Column(postgresql.UUID, unique=True, nullable=False)
+    last_seen_at = Column(TIMESTAMP(timezone=True), default=_get_date, index=True)
+    created_at = Column(TIMESTAMP(timezone=True), default=_get_date)
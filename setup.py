@@ -38,4 +38,5 @@ setup(
                       'pika',
                       'xlsxwriter',
                       'pytz',
+                      'ipaddress; python_version < "3.3"',
                       ])
@@ -0,0 +1,157 @@
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+from perception.classes.resolver import ReverseResolver, system_nameservers, ptr_name, read_name
+
+
+class StubNameserver(object):
+    def __init__(self):
+        """A UDP nameserver on localhost that answers PTR queries for 10.0.0.x by the last octet:
+        9 is never answered, 8 is answered late, 7 is NXDOMAIN, 5 gets an answer to another
+        question first, anything else is host-<octet>.example.com with a ttl of 60"""
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        self.questions = list()
+
+        t = threading.Thread(target=self.serve)
+        t.daemon = True
+        t.start()
+
+    def serve(self):
+
+        while True:
+            try:
+                data, client = self.sock.recvfrom(512)
+            except socket.error:
+                return
+
+            query_id = struct.unpack('>H', data[:2])[0]
+            name, offset = read_name(bytearray(data), 12)
+            question = data[12:offset + 4]
+            self.questions.append(name)
+
+            last = name.split('.')[0]
+
+            if last == '9':
+                continue
+
+            if last == '8':
+                time.sleep(0.2)
+
+            if last == '7':
+                self.sock.sendto(struct.pack('>HHHHHH', query_id, 0x8183, 1, 0, 0, 0) + question, client)
+                continue
+
+            host = ('host-%s' % last).encode('ascii')
+            rdata = struct.pack('B', len(host)) + host + b'\x07example\x03com\x00'
+            answer = b'\xc0\x0c' + struct.pack('>HHIH', 12, 1, 60, len(rdata)) + rdata
+
+            if last == '5':
+                other = b'\x01x\x00' + struct.pack('>HH', 12, 1)
+                self.sock.sendto(struct.pack('>HHHHHH', query_id, 0x8180, 1, 1, 0, 0) + other + answer, client)
+
+            self.sock.sendto(struct.pack('>HHHHHH', query_id, 0x8180, 1, 1, 0, 0) + question + answer, client)
+
+    def close(self):
+        self.sock.close()
+
+
+class TestReverseResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.nameserver = StubNameserver()
+        self.system_lookups = list()
+
+    def tearDown(self):
+        self.nameserver.close()
+
+    def resolver(self, nameservers=None, system_names=None):
+        """A resolver on the stub nameserver whose system resolver answers from system_names"""
+
+        resolver = ReverseResolver(nameservers or [self.nameserver.address[0]], self.nameserver.address[1],
+                                   timeout=0.5, retries=1, ttl=3600, negative_ttl=300, concurrency=4)
+
+        def system_query(ip_addrs):
+            self.system_lookups.extend(ip_addrs)
+            return dict((ip_addr, ((system_names or {}).get(ip_addr), None)) for ip_addr in ip_addrs)
+
+        resolver.system_query = system_query
+        return resolver
+
+    def test_answers(self):
+        names = self.resolver().lookup_many(['10.0.0.1', '10.0.0.2', '10.0.0.5', '10.0.0.8'])
+
+        self.assertEqual(names, {'10.0.0.1': 'host-1.example.com',
+                                 '10.0.0.2': 'host-2.example.com',
+                                 '10.0.0.5': 'host-5.example.com',
+                                 '10.0.0.8': 'host-8.example.com'})
+        self.assertEqual(self.system_lookups, [])
+
+    def test_cache(self):
+        resolver = self.resolver()
+        resolver.lookup_many(['10.0.0.1', '10.0.0.7'])
+        asked = len(self.nameserver.questions)
+
+        self.assertEqual(resolver.lookup('10.0.0.1'), 'host-1.example.com')
+        self.assertIsNone(resolver.lookup('10.0.0.7'))
+        self.assertEqual(len(self.nameserver.questions), asked)
+
+        # names are kept for the record's ttl, misses for negative_ttl
+        self.assertLessEqual(resolver.cache['10.0.0.1'][1] - time.time(), 60)
+        self.assertGreater(resolver.cache['10.0.0.7'][1] - time.time(), 250)
+
+    def test_silent_zone(self):
+        resolver = self.resolver()
+
+        started = time.time()
+        names = resolver.lookup_many(['10.0.0.9', '10.0.0.1'])
+
+        self.assertEqual(names, {'10.0.0.9': None, '10.0.0.1': 'host-1.example.com'})
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual(self.nameserver.questions.count('9.0.0.10.in-addr.arpa'), 2)
+
+    def test_not_an_address(self):
+        self.assertEqual(self.resolver().lookup_many(['bogus']), {'bogus': None})
+        self.assertRaises(ValueError, ptr_name, 'bogus')
+        self.assertEqual(ptr_name('2001:db8::1'), '.'.join(reversed('20010db8' + '0' * 23 + '1')) + '.ip6.arpa')
+
+    def test_next_nameserver(self):
+        resolver = self.resolver(['127.0.0.2', '127.0.0.1'])
+
+        # nothing answers on 127.0.0.2, the stub on 127.0.0.1 is asked next
+        self.assertEqual(resolver.lookup_many(['10.0.0.1', '10.0.0.7']), {'10.0.0.1': 'host-1.example.com',
+                                                                          '10.0.0.7': None})
+        self.assertEqual(self.system_lookups, ['10.0.0.7'])
+
+    def test_system_fallback(self):
+        resolver = self.resolver(system_names={'10.0.0.7': 'seven.hosts', '10.0.0.9': 'nine.hosts'})
+
+        names = resolver.lookup_many(['10.0.0.1', '10.0.0.7', '10.0.0.9'])
+
+        self.assertEqual(names, {'10.0.0.1': 'host-1.example.com',
+                                 '10.0.0.7': 'seven.hosts',
+                                 '10.0.0.9': 'nine.hosts'})
+        self.assertEqual(sorted(self.system_lookups), ['10.0.0.7', '10.0.0.9'])
+
+    def test_system_nameservers(self):
+        fd, conf = tempfile.mkstemp()
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('search example.com\nnameserver 10.1.1.1\n# nameserver 10.9.9.9\nnameserver 10.1.1.2\n')
+
+            self.assertEqual(system_nameservers(conf), ['10.1.1.1', '10.1.1.2'])
+            self.assertEqual(system_nameservers(conf + '.missing'), [])
+
+        finally:
+            os.remove(conf)
+
+
+if __name__ == '__main__':
+    unittest.main()